@@ -1,10 +1,17 @@
+import json
 import random
-from copy import deepcopy
+import atexit
+import threading
+import multiprocessing
 import numpy as np
-from time import time
-from typing import Optional, Tuple, List
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from time import time, perf_counter
+from typing import Optional, Tuple, List, NamedTuple, Callable
 
-from agents.common import check_board_full, check_open_columns, apply_player_action, check_end_state, connected_four
+from agents.common import check_end_state, make_rng_state, Board, NodeTable
+from agents.kernels import compiled, warm_up
+from agents import kernels
 from agents.common import PLAYER1, PLAYER2, GameState, BoardPiece, SavedState, NO_PLAYER, PlayerAction
 
 # Typical Python style is to put related classes in the same module. (no consensus - from stack overflow)
@@ -14,13 +21,207 @@ from agents.common import PLAYER1, PLAYER2, GameState, BoardPiece, SavedState, N
 PLAYER = NO_PLAYER
 OPPONENT = NO_PLAYER
 
-def generate_move(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState])\
+# compiled rollout kernels (ahead-of-time compiled versions if they have been built)
+random_playout = compiled('random_playout')
+random_playout_record = compiled('random_playout_record')
+random_playouts_batch = compiled('random_playouts_batch')
+# jitted rollout kernels, release the GIL for the threads of a tree-parallel search
+random_playout_nogil = kernels.random_playout
+random_playout_record_nogil = kernels.random_playout_record
+random_playouts_batch_nogil = kernels.random_playouts_batch
+
+class Budget(NamedTuple):
+    """
+    Limits of a search, it stops at the first one that is reached (None means no limit)
+    """
+    seconds: Optional[float] = 5.0  # wall time
+    iterations: Optional[int] = None  # selection/simulation/backpropagation rounds (per search)
+    nodes: Optional[int] = None  # nodes in the tree
+    check_every: int = 32  # iterations between two looks at the clock
+
+# pondering runs until the opponent has moved, the node limit bounds its memory and the time
+# limit ends it if the next move never comes (e.g. the game is over)
+PONDER_BUDGET = Budget(seconds=30.0, nodes=1 << 21)
+
+class SearchStats:
+    """
+    Counters of one search (see MCTS(stats=True)). The phase times are summed over the threads of the
+    search, the worker processes of a root-parallel search only show up in the root visits.
+    """
+    def __init__(self):
+        self.iterations = 0
+        self.seconds = 0.0  # wall time of the search
+        self.nodes = 0  # nodes allocated in the tree
+        self.max_depth = 0  # depth of the deepest leaf selected (root = 0)
+        self.total_depth = 0  # sum of the depths of the selected leaves
+        # time spent in the phases of the iterations
+        self.selection = 0.0
+        self.simulation = 0.0
+        self.backpropagation = 0.0
+        # moves, visits and mean values of the root's children after the search
+        self.root_moves = []
+        self.root_visits = []
+        self.root_values = []
+
+    @property
+    def iterations_per_second(self) -> float:
+        return self.iterations / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def average_depth(self) -> float:
+        return self.total_depth / self.iterations if self.iterations else 0.0
+
+    def add_iteration(self, depth: int, selection: float, simulation: float, backpropagation: float):
+        """
+        counts one iteration
+        :param depth: depth of the selected leaf
+        :param selection: seconds spent in selection and expansion
+        :param simulation: seconds spent in the rollout
+        :param backpropagation: seconds spent in backpropagation
+        """
+        self.iterations += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+        self.selection += selection
+        self.simulation += simulation
+        self.backpropagation += backpropagation
+
+    def finish(self, tree: 'Tree', seconds: float):
+        """
+        records the size of tree and the statistics of its root after the search
+        :param tree: searched tree
+        :param seconds: wall time of the search
+        """
+        self.seconds = seconds
+        self.nodes = tree.size
+        children = tree.children(Tree.ROOT)
+        visits = tree.visits[children]
+        self.root_moves = tree.move[children].tolist()
+        self.root_visits = visits.tolist()
+        self.root_values = (tree.values[children] / np.maximum(visits, 1)).tolist()
+
+    def as_dict(self) -> dict:
+        """
+        :return: the counters as plain python values, e.g. for one line of a JSON log
+        """
+        stats = dict(vars(self))
+        stats['iterations_per_second'] = self.iterations_per_second
+        stats['average_depth'] = self.average_depth
+        return stats
+
+def json_log(path: str) -> Callable[[SearchStats], None]:
+    """
+    returns a stats_hook for generate_move that appends the stats of every search to a file, one JSON
+    object per line
+    :param path: log file
+    """
+    def write(stats: SearchStats):
+        with open(path, 'a') as file:
+            file.write(json.dumps(dict(stats.as_dict(), time=time())) + '\n')
+    return write
+
+# worker processes of the root-parallel search, kept alive between moves (see worker_pool)
+_pool = None
+_pool_workers = 0
+_pool_cancel = None  # multiprocessing.Event that stops the searches of the workers
+# the worker's copy of _pool_cancel (set by init_worker in the worker processes)
+_worker_cancel = None
+
+def init(board: np.ndarray, player: BoardPiece):
+    """
+    init hook (see main.human_vs_agent): compiles or loads the rollout kernels before the clock starts
+    :param board: initial board
+    :param player: player the agent plays as
+    """
+    warm_up()
+
+def init_worker(cancel: multiprocessing.Event):
+    """
+    initializer of the worker processes: keeps the cancel event of the pool and loads the kernels
+    :param cancel: event set by the calling process to stop the running searches
+    """
+    global _worker_cancel
+
+    _worker_cancel = cancel
+    warm_up()
+
+def worker_pool(workers: int) -> Optional[ProcessPoolExecutor]:
+    """
+    returns the process pool for a root-parallel search with workers searches in total (the calling
+    process runs one of them), the pool is created on first use and kept for the following moves
+    :param workers: total number of parallel searches
+    :return: pool with workers - 1 processes, None for a single search
+    """
+    global _pool
+    global _pool_workers
+    global _pool_cancel
+
+    if workers != _pool_workers:
+        shutdown_pool()
+        if workers > 1:
+            _pool_cancel = multiprocessing.Event()
+            _pool = ProcessPoolExecutor(workers - 1, initializer=init_worker, initargs=(_pool_cancel,))
+            _pool_workers = workers
+    return _pool
+
+def shutdown_pool():
+    """
+    stops the worker processes of the root-parallel search
+    """
+    global _pool
+    global _pool_workers
+
+    if _pool is not None:
+        # searches without a limit only end when they are cancelled
+        _pool_cancel.set()
+        _pool.shutdown()
+    _pool = None
+    _pool_workers = 0
+
+atexit.register(shutdown_pool)
+
+def root_search(board: np.ndarray, last_player: BoardPiece, player: BoardPiece, seed: int, start_time: float,
+                **options) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    independent search of a root-parallel MCTS (runs in a worker process)
+    :param board: position at the root
+    :param last_player: player who made the last move in that position
+    :param player: player whose move is searched
+    :param seed: seed of the search's random numbers
+    :param start_time: start time of the search in the calling process, all searches end together
+    :param options: keyword arguments of the MCTS object (budget, rave, ...)
+    :return: moves, visits, values and proofs of the root's children
+    """
+    random.seed(seed)
+    tree = Tree(board, last_player)
+    # in a worker process the calling process can stop the search through the pool's cancel event
+    mcts = MCTS(player, seed=seed, cancel=_worker_cancel, **options)
+    mcts.start_time = start_time
+    mcts.search(tree)
+    children = list(tree.children(Tree.ROOT))
+    return tree.move[children], tree.visits[children], tree.values[children], tree.proven[children]
+
+def generate_move(board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState], workers: int = 1,
+                  threads: int = 1, budget: Budget = Budget(), ponder: bool = False, batch_size: int = 1,
+                  rave: bool = False, transpositions: int = 0, stats: bool = False,
+                  stats_hook: Optional[Callable[[SearchStats], None]] = None,
+                  cancel: Optional[threading.Event] = None)\
         -> Tuple[PlayerAction, Optional[SavedState]]:
     """
     generates an optimal move/action using the Monte Carlo Tree Search strategy
     :param board: current state of board
     :param player: player whose move is optimized
     :param saved_state: saved state of board
+    :param workers: number of parallel searches (root parallelization over processes)
+    :param threads: number of threads searching the same tree (tree parallelization)
+    :param budget: limits of the search (time, iterations, nodes)
+    :param ponder: keep searching in a background thread while the opponent thinks
+    :param batch_size: number of leaves selected and simulated together
+    :param rave: blend all-moves-as-first statistics into the ucb values (RAVE)
+    :param transpositions: size of the table that merges transpositions into a search DAG (0 for a plain tree)
+    :param stats: collect the SearchStats of the search in saved_state.stats
+    :param stats_hook: called with the SearchStats after every search (implies stats), e.g. to write a log
+    :param cancel: setting this event from another thread stops the search, the best move found so far is played
     :return: move, saved_state (optional)
     """
 
@@ -39,104 +240,384 @@ def generate_move(board: np.ndarray, player: BoardPiece, saved_state: Optional[S
         action = 3
 
     else:
-        # create root Node object
-        root = Node(board_copy=deepcopy(board), parent=None, col=-1, player=PLAYER)
+        # reuse the subtree of the current position from our last search, if there is one
+        tree = None
+        if isinstance(saved_state, MCTSSavedState):
+            saved_state.stop_pondering()
+            tree = saved_state.find_root(board)
+        if tree is None:
+            # create the search tree (the opponent made the last move)
+            tree = Tree(board, OPPONENT)
         # create MCTS object for player
-        mcts = MCTS(PLAYER) #to start the time
-        # call monte carlo tree search starting from root node
-        action = mcts.monte_carlo_tree_search(root)
+        mcts = MCTS(PLAYER, workers=workers, threads=threads, budget=budget, batch_size=batch_size,
+                    rave=rave, transpositions=transpositions, stats=stats or stats_hook is not None,
+                    cancel=cancel) #to start the time
+        # call monte carlo tree search starting from the root node
+        action = mcts.monte_carlo_tree_search(tree)
+        # keep the subtree of our move for the next call
+        saved_state = MCTSSavedState(tree, tree.child(Tree.ROOT, action))
+        saved_state.stats = mcts.stats
+        if stats_hook is not None:
+            stats_hook(mcts.stats)
+        if ponder:
+            saved_state.start_pondering(OPPONENT)
 
     # return optimal action for player
     return PlayerAction(action), saved_state
 
 
-class Node:
-    def __init__(self, board_copy: np.ndarray, parent: object, col: int, player: BoardPiece) -> object:
-        self.board = deepcopy(board_copy)
-        self.parent = parent
-        self.column_move = col  # node belongs to move in this column
-        self.player = player
-        self.is_root = parent is None
-        self.children = []
-        self.value = 0
-        self.num_visits = 0
-        self.unexpanded_moves = check_open_columns(board_copy) # all possible moves for current board
+class MCTSSavedState(SavedState):
+    """
+    Search tree carried over between calls of generate_move
+    """
+    def __init__(self, tree: 'Tree', node: int):
+        self.tree = tree
+        self.node = node  # node of the position after our last move
+        self.ponder = None  # search running on the opponent's time
+        self.ponder_thread = None
+        self.stats = None  # SearchStats of the search that chose our last move (if collected)
 
-    def expansion(self, move: int, state: np.ndarray, player: BoardPiece) -> object:
+    def start_pondering(self, opponent: BoardPiece, budget: Budget = PONDER_BUDGET):
         """
-        expands list of children of given node and removes child from unexpanded moves
-        :param move: column move
-        :param state: current board
-        :param player: player
-        :return: child Node
+        searches the position after our move in a background (daemon) thread until stop_pondering is
+        called or the budget is used up, the opponent's likely replies get most of the visits
+        :param opponent: player to move in that position
+        :param budget: limits of the background search
         """
-        child = Node(board_copy=state, parent=self, col=move, player=player)
-        self.unexpanded_moves.remove(move)
-        self.children.append(child)
-        return child
+        self.tree, self.node = self.tree.subtree(self.node), Tree.ROOT
+        self.ponder = MCTS(opponent, budget=budget, rave=self.tree.rave)
+        # rollouts in the kernels that release the GIL, so the other threads aren't slowed down
+        self.ponder.playout = random_playout_nogil
+        self.ponder.playout_record = random_playout_record_nogil
+        self.ponder_thread = threading.Thread(target=self.ponder.search, args=(self.tree,), daemon=True)
+        self.ponder_thread.start()
 
-    def ucb_value(self) -> float:
+    def stop_pondering(self):
         """
-        strategy ucb1
-        :return: upper confidence bound for selections & expansion of given node
+        stops the background search (if there is one), its results stay in the tree
+        """
+        if self.ponder is not None:
+            self.ponder.stop()
+            self.ponder_thread.join()
+        self.ponder = None
+        self.ponder_thread = None
+
+    def find_root(self, board: np.ndarray) -> Optional['Tree']:
+        """
+        finds the node of the position after the opponent's reply to our last move and makes it the
+        root of a new tree (the rest of the old tree is dropped)
+        :param board: current state of board
+        :return: tree below the new root, None if the reply isn't in the tree (or board isn't a reply to our move)
+        """
+        self.stop_pondering()
+        changed = np.argwhere(board != self.tree.node_board(self.node))
+        if len(changed) != 1:
+            return None
+        reply = self.tree.child(self.node, changed[0][1])
+        if reply is None or not np.array_equal(self.tree.node_board(reply), board):
+            return None
+        return self.tree.subtree(reply)
+
+
+class Tree:
+    """
+    Search tree stored as a struct of arrays, node i has visits[i], values[i], parent[i], ...
+    The children of a node are allocated in one block (first_child, num_children) when it is expanded.
+    Nodes only store the move into them, boards are rebuilt along the path from the root.
+    Solved nodes are marked in proven, from the point of view of the player who moved into the node.
+    With a NodeTable (see enable_transpositions), nodes of the same position share one block of children,
+    which makes the tree a DAG: the subtree below a position is only searched once, however it is reached.
+    parent then points to the node through which a block was first added.
+    """
+    ROOT = 0
+    CHUNK = 1 << 14  # nodes added per reallocation
+    FIELDS = ('visits', 'values', 'parent', 'first_child', 'num_children', 'move', 'player', 'proven')
+    RAVE_FIELDS = ('amaf_visits', 'amaf_values')  # only allocated by enable_rave
+    # values of proven
+    UNKNOWN = 0
+    WIN = 1
+    LOSS = -1
+    DRAW = 2
+
+    def __init__(self, board: np.ndarray, player: BoardPiece, capacity: int = CHUNK):
+        """
+        :param board: position at the root
+        :param player: player who made the last move in that position
+        :param capacity: number of nodes allocated up front
+        """
+        self.board = board.copy()
+        self.size = 1
+        self.visits = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros(capacity, dtype=np.float64)  # sum of simulation results for player[i]
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.first_child = np.full(capacity, -1, dtype=np.int32)
+        self.num_children = np.zeros(capacity, dtype=np.int8)
+        self.move = np.full(capacity, -1, dtype=np.int8)  # column of the move into the node
+        self.player = np.zeros(capacity, dtype=BoardPiece)  # player who made the move into the node
+        self.proven = np.zeros(capacity, dtype=np.int8)  # game theoretic value of the node (UNKNOWN if not solved)
+        self.player[self.ROOT] = player
+        self.fields = self.FIELDS
+        self.rave = False
+        self.table = None  # NodeTable of the search DAG
+
+    def enable_rave(self):
+        """
+        adds all-moves-as-first statistics: amaf_visits[i] counts the simulations through the parent of i
+        in which player[i] took the cell of move[i] at some point, amaf_values[i] sums their results for player[i]
+        """
+        if self.rave:
+            return
+        self.amaf_visits = np.zeros(self.capacity, dtype=np.int32)
+        self.amaf_values = np.zeros(self.capacity, dtype=np.float32)
+        self.fields = self.FIELDS + self.RAVE_FIELDS
+        self.rave = True
+
+    def enable_transpositions(self, size: int = 2**16):
+        """
+        merges transpositions from now on: a node expanded after another node of the same position
+        shares its children (see NodeTable)
+        :param size: number of entries of the table
+        """
+        if self.table is None:
+            self.table = NodeTable(size)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.visits)
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: memory used by the node arrays
+        """
+        return sum(getattr(self, name).nbytes for name in self.fields) + (self.table.nbytes if self.table else 0)
+
+    def grow(self, count: int):
+        """
+        makes room for count more nodes by reallocating the arrays in chunks
+        :param count: number of nodes to add
+        """
+        if self.size + count <= self.capacity:
+            return
+        capacity = self.capacity + max(self.CHUNK, count)
+        for name in self.fields:
+            old = getattr(self, name)
+            new = np.full(capacity, -1 if name in ('parent', 'first_child', 'move') else 0, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def expand(self, node: int, moves: Tuple[int, ...]) -> int:
+        """
+        allocates the children of node, one for every move
+        :param node: node to expand
+        :param moves: columns open in the position of node
+        :return: index of the first child
+        """
+        count = len(moves)
+        self.grow(count)
+        first = self.size
+        children = slice(first, first + count)
+        self.parent[children] = node
+        self.move[children] = moves
+        self.player[children] = PLAYER1 if self.player[node] == PLAYER2 else PLAYER2
+        self.first_child[node] = first
+        self.num_children[node] = count
+        self.size += count
+        return first
+
+    def children(self, node: int) -> range:
+        """
+        :return: indices of the children of node
+        """
+        first = self.first_child[node]
+        return range(first, first + self.num_children[node]) if first >= 0 else range(0)
+
+    def child(self, node: int, move: int) -> Optional[int]:
+        """
+        :return: child of node for the move, None if there is none
+        """
+        for child in self.children(node):
+            if self.move[child] == move:
+                return child
+        return None
+
+    def path(self, node: int) -> List[int]:
+        """
+        :return: nodes from the root down to node
+        """
+        path = [node]
+        while self.parent[path[-1]] >= 0:
+            path.append(self.parent[path[-1]])
+        return path[::-1]
+
+    def node_board(self, node: int) -> np.ndarray:
+        """
+        rebuilds the board of node by playing the moves along its path on the root board
         """
-        if self.num_visits == 0:
-            return np.inf
-        np.seterr(divide='ignore') # turn off RuntimeWarning for possible division by 0
-        return self.value/self.num_visits + np.sqrt(2) * np.sqrt(np.log(self.parent.num_visits) / self.num_visits)
+        board = Board(self.board)
+        for on_path in self.path(node)[1:]:
+            board.play(int(self.move[on_path]), self.player[on_path])
+        return board.state
+
+    def subtree(self, node: int) -> 'Tree':
+        """
+        copies the subtree below node into a new, compact tree with node as its root
+        :param node: new root
+        :return: new tree
+        """
+        tree = Tree(self.node_board(node), self.player[node], capacity=self.capacity)
+        statistics = ('visits', 'values', 'proven')
+        if self.rave:
+            tree.enable_rave()
+            statistics += self.RAVE_FIELDS
+        for name in statistics:
+            getattr(tree, name)[Tree.ROOT] = getattr(self, name)[node]
+
+        # copy level by level, the child blocks of a level are laid out one after the other (a block shared
+        # by several nodes is copied once, transpositions are always on the same level)
+        if self.table is not None:
+            tree.enable_transpositions(self.table.size)
+        old_level, new_level = np.array([node]), np.array([Tree.ROOT])
+        while len(old_level):
+            counts = self.num_children[old_level].astype(np.int64)
+            expanded = counts > 0
+            old_level, new_level = old_level[expanded], new_level[expanded]
+            blocks, first, inverse = np.unique(self.first_child[old_level], return_index=True, return_inverse=True)
+            counts = counts[expanded][first]
+            total = int(counts.sum())
+            offsets = np.cumsum(counts) - counts
+            old_children = np.repeat(blocks - offsets, counts) + np.arange(total)
+            new_children = np.arange(tree.size, tree.size + total)
+            tree.first_child[new_level] = tree.size + offsets[inverse]
+            tree.num_children[new_level] = counts[inverse]
+            tree.parent[new_children] = np.repeat(new_level[first], counts)
+            for name in statistics + ('move', 'player'):
+                getattr(tree, name)[new_children] = getattr(self, name)[old_children]
+            tree.size += total
+            old_level, new_level = old_children, new_children
+        return tree
+
 
 class MCTS:
-    def __init__(self, player: BoardPiece) -> object:
+    def __init__(self, player: BoardPiece, seed: Optional[int] = None, workers: int = 1, threads: int = 1,
+                 virtual_loss: float = 1.0, budget: Budget = Budget(), cancel: Optional[threading.Event] = None,
+                 batch_size: int = 1, rave: bool = False, rave_equivalence: float = 50.0,
+                 transpositions: int = 0, stats: bool = False) -> object:
         self.player = player
+        self.opponent = PLAYER1 if player == PLAYER2 else PLAYER2
         self.start_time = time()  # set a time limit for exploration
+        self.rng_state = make_rng_state(seed)  # random number generator of the compiled rollouts
+        self.workers = workers  # number of independent searches merged at the root
+        self.threads = threads  # number of threads searching the same tree
+        self.virtual_loss = virtual_loss  # loss added to the path of a running simulation (with threads > 1)
+        # with threads the rollouts run in the jitted kernel, which releases the GIL
+        self.playout = random_playout if threads == 1 else random_playout_nogil
+        # batch evaluator of the leaves of batch_size selections: (boards, players to move, rng_state) -> winners
+        self.batch_size = batch_size
+        self.batch_playout = random_playouts_batch if threads == 1 else random_playouts_batch_nogil
+        # RAVE: all-moves-as-first statistics, weighted by sqrt(k / (3 visits + k)) with k = rave_equivalence
+        if rave and batch_size > 1:
+            raise ValueError("RAVE needs the moves of every rollout, it can't be used with batch_size > 1")
+        self.rave = rave
+        self.rave_equivalence = rave_equivalence
+        self.playout_record = random_playout_record if threads == 1 else random_playout_record_nogil
+        self.transpositions = transpositions  # size of the NodeTable of the search DAG, 0 for a plain tree
+        self.budget = budget
+        self.cancel = threading.Event() if cancel is None else cancel  # set to stop the search early
+        self.iterations = 0  # iterations run by this object
+        self.next_clock_check = 0  # iteration count at which the clock is looked at next
+        self.out_of_time = False
+        self.stats = SearchStats() if stats else None  # counters of the search, only kept if asked for
 
-    def backpropagation(self, node: Node, simulation_result: int):
+    def backpropagation(self, tree: Tree, path: List[int], simulation_result: float,
+                        virtual_loss: Optional[float] = None):
         """
-        backpropagates value and number of vists
-        :param node: leaf node
-        :param result: game simulation result
-        :return: recursive call until root node is hit (returns void/nothing)
+        backpropagates value and number of vists along the path of the last selection
+        :param tree: search tree
+        :param path: nodes from the root down to the leaf
+        :param simulation_result: game simulation result for the player of the leaf node
+        :param virtual_loss: virtual loss the selection added to the path, it is taken back
         """
-        # stop recursive call at root node
-        if node.is_root:
-            return
-        # update node's value and number of visits
-        node.value += simulation_result # value counts wins/losses
-        node.num_visits += 1
-        # recursive call to backpropagate result
-        self.backpropagation(node.parent, simulation_result)
+        path = np.asarray(path)
+        if virtual_loss is None:
+            tree.visits[path] += 1
+        else:
+            # the visits were already counted by the selection
+            tree.values[path] += virtual_loss
+        # values count wins/losses of the player who moved into the node (draws count for both)
+        if simulation_result in (1, -1):
+            leaf_player = tree.player[path[-1]]
+            tree.values[path] += np.where(tree.player[path] == leaf_player, simulation_result, -simulation_result)
+        else:
+            tree.values[path] += simulation_result
+
+    def update_amaf(self, tree: Tree, path: List[int], simulation_result: float, moves: np.ndarray, board: Board):
+        """
+        updates the all-moves-as-first statistics of the children of the nodes on path: a child gets the
+        simulation result if its player took the cell its move lands on at any point after the node (in the
+        tree or the rollout); cells instead of columns, because a column means a different cell later on
+        :param tree: search tree
+        :param path: nodes from the root down to the leaf
+        :param simulation_result: game simulation result for the player of the leaf node
+        :param moves: cells played in the rollout from the leaf (see random_playout_record)
+        :param board: board of the leaf
+        """
+        leaf_player = tree.player[path[-1]]
+        columns = board.columns
+        # cells taken by each player after the node, as bits
+        played = {PLAYER1: 0, PLAYER2: 0}
+        player = PLAYER2 if leaf_player == PLAYER1 else PLAYER1
+        for cell in moves:
+            if cell < 0:
+                break
+            played[player] |= 1 << int(cell)
+            player = PLAYER2 if player == PLAYER1 else PLAYER1
+        heights = np.array(board.heights)  # column heights of the node, going up the path
+        for i in range(len(path) - 1, -1, -1):
+            if i + 1 < len(path):
+                child = path[i + 1]
+                heights[tree.move[child]] -= 1
+                played[tree.player[child]] |= 1 << int(heights[tree.move[child]] * columns + tree.move[child])
+            node = path[i]
+            if tree.num_children[node] == 0:
+                continue
+            children = slice(tree.first_child[node], tree.first_child[node] + tree.num_children[node])
+            child_player = tree.player[children.start]
+            child_moves = tree.move[children].astype(np.int64)
+            hit = (played[child_player] >> (heights[child_moves] * columns + child_moves)) & 1
+            if simulation_result in (1, -1) and child_player != leaf_player:
+                result = -simulation_result
+            else:
+                result = simulation_result
+            tree.amaf_visits[children] += hit.astype(np.int32)
+            tree.amaf_values[children] += hit * result
 
-    def best_child(self, root: Node) -> Node:
+    def best_child(self, tree: Tree) -> int:
         """
         finds the best (optimal) next move
-        :param root: current game state/ node
-        :return: optimal next node to make root node
+        :param tree: search tree, the root is the current game state (expanded)
+        :return: optimal child of the root
         """
+        children = list(tree.children(Tree.ROOT))
+        # always return proven wins (this includes immediate wins)
+        for child in children:
+            if tree.proven[child] == Tree.WIN:
+                return child
         # set the best ratio the a (large) negative number
         best_ratio = -np.infty
-        # declare best action and urgent block
         best_action = None
-        urgent_block = None
-        # loop through child nodes
-        for child in root.children:
-            # create board for opponent move in child column
-            opponent_board = apply_player_action(deepcopy(root.board), child.column_move, OPPONENT)
-            # always return immediate wins
-            if connected_four(child.board, child.player):
-                return child
-            # block immediate loss (if you don't play position and opponent can win by playing there next)
-            elif connected_four(opponent_board, OPPONENT):
-                urgent_block = child # you can only block one position at a time anyway
-            # find child with highest value/visits ratio
-            else:
-                ratio = child.value / child.num_visits
+        # find child with highest value/visits ratio, leaving out proven losses (e.g. not blocking an immediate loss)
+        for child in children:
+            if tree.proven[child] != Tree.LOSS and tree.visits[child] > 0:
+                ratio = tree.values[child] / tree.visits[child]
                 if ratio > best_ratio:
                     best_action = child
                     best_ratio = ratio
-        if urgent_block != None:  # check blocks in the end to prefer wins over blocks
-            return urgent_block
-        else:
+        if best_action is not None:
             return best_action
+        # nothing searched yet or every move loses: the most visited move that isn't proven lost (longest resistance)
+        candidates = [child for child in children if tree.proven[child] != Tree.LOSS] or children
+        return max(candidates, key=lambda child: tree.visits[child])
 
     def check_time(self, time_limit: int) -> bool:
         """
@@ -144,35 +625,305 @@ class MCTS:
         """
         return (time() - self.start_time) < time_limit
 
-    def highest_ucb(self, node: Node) -> Node:
+    def searching(self, tree: Tree) -> bool:
+        """
+        checks the budget, the clock only every budget.check_every iterations
+        :param tree: search tree
+        :return: True while the search wasn't cancelled and no limit of the budget was reached
+        """
+        budget = self.budget
+        if self.cancel.is_set():
+            return False
+        # the game theoretic value of the root is known
+        if tree.proven[Tree.ROOT] != Tree.UNKNOWN:
+            return False
+        if budget.iterations is not None and self.iterations >= budget.iterations:
+            return False
+        if budget.nodes is not None and tree.size >= budget.nodes:
+            return False
+        if budget.seconds is not None and self.iterations >= self.next_clock_check:
+            self.next_clock_check = self.iterations + budget.check_every
+            self.out_of_time = not self.check_time(budget.seconds)
+        return not self.out_of_time
+
+    def stop(self):
+        """
+        cancels the search (from another thread), monte_carlo_tree_search then returns the best move so far
+        """
+        self.cancel.set()
+
+    def best_move(self, tree: Tree) -> int:
+        """
+        returns the best move according to the current state of the search (anytime)
+        :param tree: search tree, the root is the current game state
+        :return: column of the best move
+        """
+        if tree.num_children[Tree.ROOT] == 0:
+            self.expansion(tree, Tree.ROOT, Board(tree.board))
+        chosen_node = self.best_child(tree)
+        return int(tree.move[chosen_node])
+
+    def expansion(self, tree: Tree, node: int, board: Board):
+        """
+        adds all children of node and solves the ones whose move ends the game
+        :param tree: search tree
+        :param node: leaf node
+        :param board: board of node
+        """
+        moves = board.legal_moves()
+        if not moves:  # board is full
+            tree.proven[node] = Tree.DRAW
+            return
+        if tree.table is not None:
+            # a transposition of an expanded node shares its children
+            other = tree.table.lookup(board.hash)
+            if other is not None and other != node and tree.num_children[other] > 0:
+                tree.first_child[node] = tree.first_child[other]
+                tree.num_children[node] = tree.num_children[other]
+                self.prove(tree, [node])
+                return
+            tree.table.store(board.hash, node, tree.visits)
+        first = tree.expand(node, moves)
+        for child in range(first, first + len(moves)):
+            board.play(int(tree.move[child]), tree.player[child])
+            if board.connected_four(tree.player[child]):
+                tree.proven[child] = Tree.WIN
+            elif board.is_full():
+                tree.proven[child] = Tree.DRAW
+            board.undo()
+        self.prove(tree, [node])
+
+    def prove(self, tree: Tree, path: List[int]):
+        """
+        backs up proofs minimax-style from the end of path towards the root: a node is lost if one
+        of its children (the opponent's moves) is won, won if all of its children are lost and a
+        draw if all of them are solved, none won and one drawn
+        :param tree: search tree
+        :param path: nodes from the root down to the node that was last solved (or expanded)
+        """
+        for node in reversed(path):
+            if tree.proven[node] != Tree.UNKNOWN:
+                continue
+            if tree.num_children[node] == 0:
+                break
+            first = tree.first_child[node]
+            proven = tree.proven[first:first + tree.num_children[node]]
+            if (proven == Tree.WIN).any():
+                tree.proven[node] = Tree.LOSS
+            elif (proven == Tree.UNKNOWN).any():
+                break
+            elif (proven == Tree.DRAW).any():
+                tree.proven[node] = Tree.DRAW
+            else:
+                tree.proven[node] = Tree.WIN
+
+    def ucb_values(self, tree: Tree, node: int) -> np.ndarray:
+        """
+        strategy ucb1
+        :return: upper confidence bounds of the children of node (inf for unvisited children)
+        """
+        children = slice(tree.first_child[node], tree.first_child[node] + tree.num_children[node])
+        visits = tree.visits[children]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = tree.values[children] / visits
+            if self.rave:
+                # blend in the all-moves-as-first value, its weight goes to 0 as the child gets visits
+                amaf_visits = tree.amaf_visits[children]
+                amaf_value = np.where(amaf_visits > 0, tree.amaf_values[children] / amaf_visits, value)
+                beta = np.sqrt(self.rave_equivalence / (3 * visits + self.rave_equivalence))
+                value = (1 - beta) * value + beta * amaf_value
+            # in a DAG the children can be visited through other parents as well
+            parent_visits = tree.visits[node] if tree.table is None else max(tree.visits[node], visits.sum())
+            ucb = value + np.sqrt(2) * np.sqrt(np.log(parent_visits) / visits)
+        ucb[visits == 0] = np.inf
+        return ucb
+
+    def highest_ucb(self, tree: Tree, node: int) -> Optional[int]:
         """
-        returns node (out of children) with the highest ucb value
-        :param node: root node
+        returns node (out of children) with the highest ucb value, a random unvisited child first,
+        solved children are skipped
+        :param tree: search tree
+        :param node: parent node
         :return: child with highest ucb
         """
         # don't return anything for terminal/leaf node
-        if len(node.children) == 0:
+        if tree.num_children[node] == 0:
             return None
+        first = tree.first_child[node]
+        children = slice(first, first + tree.num_children[node])
+        unsolved = tree.proven[children] == Tree.UNKNOWN
+        unvisited = np.flatnonzero((tree.visits[children] == 0) & unsolved)
+        if len(unvisited):
+            return first + self.select_random_child(unvisited)
         # select child node with the max ucb value
-        return max(node.children, key=Node.ucb_value)
+        ucb = self.ucb_values(tree, node)
+        ucb[~unsolved] = -np.inf
+        return first + int(np.argmax(ucb))
 
-    def monte_carlo_tree_search(self, root: Node) -> int:
+    def merge_root(self, tree: Tree, moves: np.ndarray, visits: np.ndarray, values: np.ndarray,
+                   proven: np.ndarray):
+        """
+        adds the root statistics of another search from the same position to tree
+        :param tree: search tree
+        :param moves: moves of the root's children in the other search
+        :param visits: visits of those children
+        :param values: values of those children
+        :param proven: proofs of those children
+        """
+        if tree.num_children[Tree.ROOT] == 0:
+            self.expansion(tree, Tree.ROOT, Board(tree.board))
+        for move, child_visits, child_value, child_proven in zip(moves, visits, values, proven):
+            child = tree.child(Tree.ROOT, move)
+            tree.visits[child] += child_visits
+            tree.values[child] += child_value
+            if child_proven != Tree.UNKNOWN:
+                tree.proven[child] = child_proven
+        tree.visits[Tree.ROOT] += visits.sum()
+        self.prove(tree, [Tree.ROOT])
+
+    def monte_carlo_tree_search(self, tree: Tree) -> int:
         """
         returns column value of optimal move
-        :param root: root Node
+        :param tree: search tree, the root is the current game state
         :return: column that is the optimal move
         """
-        root.num_visits += 1  # root node isn't 0, it's visited first to get the leaf node (otherwise I get nan values)
-        while self.check_time(5):
+        # root parallelization: the other searches run in the worker processes while we search tree
+        pool = worker_pool(self.workers)
+        searches = []
+        if pool is not None:
+            seed = int(self.rng_state[0])
+            _pool_cancel.clear()
+            options = dict(budget=self.budget, rave=self.rave, transpositions=self.transpositions)
+            searches = [pool.submit(root_search, tree.board, tree.player[Tree.ROOT], self.player, seed + i,
+                                    self.start_time, **options) for i in range(1, self.workers)]
+        self.search(tree)
+        if searches and self.cancel.is_set():
+            # pass the cancellation on, the workers stop at their next iteration
+            _pool_cancel.set()
+        for search in searches:
+            self.merge_root(tree, *search.result())
+        if self.stats is not None:
+            self.stats.finish(tree, time() - self.start_time)
+        # now choose the best action (based on the ratio of node value and visits)
+        return self.best_move(tree)
+
+    def search(self, tree: Tree):
+        """
+        runs selection, simulation and backpropagation on tree until the time is up
+        :param tree: search tree, the root is the current game state
+        """
+        if self.rave:
+            tree.enable_rave()
+        if self.transpositions:
+            tree.enable_transpositions(self.transpositions)
+        tree.visits[Tree.ROOT] += 1  # root node isn't 0, it's visited first to get the leaf node (otherwise I get nan values)
+        search_loop = self.search_loop if self.batch_size == 1 else self.search_batch_loop
+        if self.threads == 1:
+            search_loop(tree, self.rng_state)
+            return
+
+        # tree parallelization: the threads share the tree, virtual loss spreads them over different paths
+        lock = threading.Lock()
+        seed = int(self.rng_state[0])
+        threads = [threading.Thread(target=search_loop, args=(tree, make_rng_state(seed + i), lock))
+                   for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def search_loop(self, tree: Tree, rng_state: np.ndarray, lock: Optional[threading.Lock] = None):
+        """
+        search loop of one thread, the tree is only changed while holding the lock (if there is one),
+        simulations run without it
+        :param tree: search tree
+        :param rng_state: random number generator of the thread's rollouts
+        :param lock: lock of the tree shared by the threads, None for a single thread
+        """
+        board = Board(tree.board)
+        virtual_loss = None if lock is None else self.virtual_loss
+        tree_lock = nullcontext() if lock is None else lock
+        moves = np.empty(tree.board.size, dtype=np.int8) if self.rave else None  # cells played in the rollouts
+        stats = self.stats
+        while self.searching(tree):
             # selection and expansion
-            node = self.selection(root, deepcopy(root.board), self.player)
+            with tree_lock:
+                if stats is not None:
+                    start = perf_counter()
+                path = self.selection(tree, board, virtual_loss)
+                if stats is not None:
+                    selected = perf_counter()
             # simulate games
-            simulation_score = self.simulation(node)
+            simulation_score = self.simulation(tree, path[-1], board, rng_state, moves)
+            if stats is not None:
+                simulated = perf_counter()
             # backpropagation scores (update value for each visited node)
-            self.backpropagation(node, simulation_score)
-        # now choose the best action (based on the ratio of node value and visits)
-        chosen_node = self.best_child(root)
-        return chosen_node.column_move
+            with tree_lock:
+                self.backpropagation(tree, path, simulation_score, virtual_loss)
+                if self.rave:
+                    self.update_amaf(tree, path, simulation_score, moves, board)
+                self.iterations += 1
+                if stats is not None:
+                    stats.add_iteration(len(path) - 1, selected - start, simulated - selected,
+                                        perf_counter() - simulated)
+            # take the moves back to the root position
+            for _ in path[1:]:
+                board.undo()
+
+    def search_batch_loop(self, tree: Tree, rng_state: np.ndarray, lock: Optional[threading.Lock] = None):
+        """
+        search loop that selects batch_size leaves (spread out by virtual loss), simulates them all in one
+        call of batch_playout and backpropagates the results together, a batch is cut short where it would
+        go over the iteration or node limit of the budget
+        :param tree: search tree
+        :param rng_state: random number generator of the rollouts
+        :param lock: lock of the tree shared by the threads, None for a single thread
+        """
+        board = Board(tree.board)
+        tree_lock = nullcontext() if lock is None else lock
+        boards = np.empty((self.batch_size,) + tree.board.shape, dtype=BoardPiece)
+        budget = self.budget
+        stats = self.stats
+        while self.searching(tree):
+            paths = []
+            # selection and expansion
+            with tree_lock:
+                if stats is not None:
+                    start = perf_counter()
+                batch_size = self.batch_size
+                if budget.iterations is not None:
+                    batch_size = min(batch_size, budget.iterations - self.iterations)
+                for _ in range(batch_size):
+                    path = self.selection(tree, board, self.virtual_loss)
+                    boards[len(paths)] = board.state
+                    paths.append(path)
+                    for _ in path[1:]:
+                        board.undo()
+                    if tree.proven[Tree.ROOT] != Tree.UNKNOWN:
+                        break
+                    if budget.nodes is not None and tree.size >= budget.nodes:
+                        break
+                if stats is not None:
+                    selected = perf_counter()
+            # another thread used up the iterations in the meantime
+            if not paths:
+                break
+            # simulate games
+            simulation_scores = self.simulation_batch(tree, [path[-1] for path in paths], boards[:len(paths)], rng_state)
+            if stats is not None:
+                simulated = perf_counter()
+            # backpropagation scores
+            with tree_lock:
+                for path, simulation_score in zip(paths, simulation_scores):
+                    self.backpropagation(tree, path, simulation_score, self.virtual_loss)
+                self.iterations += len(paths)
+                if stats is not None:
+                    # the batch's times are split evenly over its iterations
+                    share = 1 / len(paths)
+                    backpropagated = perf_counter()
+                    for path in paths:
+                        stats.add_iteration(len(path) - 1, (selected - start) * share,
+                                            (simulated - selected) * share, (backpropagated - simulated) * share)
 
     def result(self, board: np.ndarray, player: BoardPiece) -> int:
         """
@@ -191,27 +942,40 @@ class MCTS:
         else:
             return 0 # for still playing
 
-    def selection(self, node: Node, root_board: np.ndarray, player: BoardPiece) -> Node:
+    def selection(self, tree: Tree, board: Board, virtual_loss: Optional[float] = None) -> List[int]:
         """
-        selects child node to expand and calls expansion
-        :param node: node thats expanded
-        :param root_board: copy of current state of the board
-        :param player: player
-        :return: expanded node
+        descends from the root to a new leaf, expanding the nodes on the way
+        :param tree: search tree
+        :param board: board of the root, the moves along the path are played on it
+        :param virtual_loss: if given, the path is counted as visited and lost by this amount until its
+                             backpropagation, so that concurrent selections take other paths
+        :return: nodes from the root down to the new leaf (or solved node that was reached)
         """
-        while node.children != [] and node.unexpanded_moves == []:
-            # select best child for expansion
-            node = self.highest_ucb(node)
-
-        # unless we've already expanded all children, add new child node with best ucb
-        if node.unexpanded_moves != []:
-            # pick unexpanded child of node with best ucb
-            move = self.select_random_child(node.unexpanded_moves)
-            # create board for child
-            child_board = apply_player_action(deepcopy(root_board), move, self.player)
-            # add child
-            node = node.expansion(move=move, state=child_board, player=player)
-        return node
+        node = Tree.ROOT
+        path = [node]
+        # solved subtrees aren't searched any further
+        while tree.proven[node] == Tree.UNKNOWN:
+            if tree.num_children[node] == 0:
+                # add all child nodes at once, this may solve node
+                self.expansion(tree, node, board)
+                if tree.proven[node] != Tree.UNKNOWN:
+                    self.prove(tree, path)
+                    break
+            elif tree.table is not None:
+                # in a DAG the shared children may have been solved below another parent
+                self.prove(tree, path)
+                if tree.proven[node] != Tree.UNKNOWN:
+                    break
+            # select best child (unvisited children first)
+            node = self.highest_ucb(tree, node)
+            board.play(int(tree.move[node]), tree.player[node])
+            path.append(node)
+            if tree.visits[node] == 0:
+                break
+        if virtual_loss is not None:
+            tree.visits[path] += 1
+            tree.values[path] -= virtual_loss
+        return path
 
     def select_random_child(self, children: List) -> int:
         """
@@ -221,24 +985,73 @@ class MCTS:
         """
         return children[random.choice(range(len(children)))]
 
-    def simulation(self, node: Node) -> int:
+    def simulation(self, tree: Tree, node: int, board: Board, rng_state: Optional[np.ndarray] = None,
+                   moves: Optional[np.ndarray] = None) -> float:
         """
         simulates game until board is full or either player won
+        :param tree: search tree
         :param node: start node
+        :param board: board of the start node
+        :param rng_state: random number generator of the rollout (default: the one of the MCTS object)
+        :param moves: if given, gets the cells played in the rollout (see random_playout_record)
         :return: result of the game simulation
         """
-        simulation_board = deepcopy(node.board)
-        player = original_player = node.player
-
-        while not check_board_full(simulation_board) and len(check_open_columns(simulation_board)) > 0:
-            avail_moves = check_open_columns(simulation_board)
-            # switch between players
-            player = PLAYER2 if player == PLAYER1 else PLAYER1  # opposite player makes a move first
-            # simulate
-            simulation_board = apply_player_action(simulation_board, avail_moves[random.choice(range(len(avail_moves)))],
-                                   player=player)
-            # early stopping in case a player won
-            if connected_four(simulation_board, player):
-                break
-        # evaluate end state of the game after simulation for the original player
-        return self.result(simulation_board, original_player)
\ No newline at end of file
+        rng_state = self.rng_state if rng_state is None else rng_state
+        original_player = tree.player[node]
+        opponent = PLAYER2 if original_player == PLAYER1 else PLAYER1
+
+        # the outcome of solved nodes is known
+        winner = self.proven_winner(tree, node)
+        if winner is not None:
+            if moves is not None:
+                moves[:] = -1
+        elif moves is None:
+            # random rollout in the compiled kernel, opposite player makes a move first
+            winner = self.playout(board.state, opponent, rng_state)
+        else:
+            winner = self.playout_record(board.state, opponent, rng_state, moves)
+        return self.score(tree, node, winner)
+
+    def simulation_batch(self, tree: Tree, nodes: List[int], boards: np.ndarray,
+                         rng_state: Optional[np.ndarray] = None) -> List[float]:
+        """
+        simulates the games of several nodes with one call of batch_playout
+        :param tree: search tree
+        :param nodes: start nodes
+        :param boards: (len(nodes), rows, columns) stack of their boards
+        :param rng_state: random number generator of the rollouts (default: the one of the MCTS object)
+        :return: results of the game simulations (see simulation)
+        """
+        winners = [self.proven_winner(tree, node) for node in nodes]
+        unsolved = [i for i, winner in enumerate(winners) if winner is None]
+        if unsolved:
+            # opposite players make the first moves
+            players = np.where(tree.player[np.asarray(nodes)[unsolved]] == PLAYER1, PLAYER2, PLAYER1).astype(BoardPiece)
+            rollouts = self.batch_playout(boards[unsolved], players, self.rng_state if rng_state is None else rng_state)
+            for i, winner in zip(unsolved, rollouts):
+                winners[i] = winner
+        return [self.score(tree, node, winner) for node, winner in zip(nodes, winners)]
+
+    def proven_winner(self, tree: Tree, node: int) -> Optional[BoardPiece]:
+        """
+        :return: winner of a solved node (NO_PLAYER for a draw), None if node isn't solved
+        """
+        if tree.proven[node] == Tree.WIN:
+            return tree.player[node]
+        elif tree.proven[node] == Tree.LOSS:
+            return PLAYER2 if tree.player[node] == PLAYER1 else PLAYER1
+        elif tree.proven[node] == Tree.DRAW:
+            return NO_PLAYER
+        return None
+
+    def score(self, tree: Tree, node: int, winner: BoardPiece) -> float:
+        """
+        evaluates the end of a game simulation for the player of node (see result)
+        :return: 1 for a win, -1 for a loss, 0.2 for a draw
+        """
+        if winner == tree.player[node]:
+            return 1
+        elif winner == NO_PLAYER:
+            return 0.2
+        else:
+            return -1
@@ -1 +1 @@
-from .agent_minimax import generate_move_minimax as generate_move
\ No newline at end of file
+from .agent_minimax import generate_move
\ No newline at end of file
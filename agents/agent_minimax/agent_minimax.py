@@ -1,24 +1,39 @@
 import numpy as np
 import math
-from typing import Optional, Tuple
-from agents.common import BoardPiece, PlayerAction, SavedState, PLAYER1, PLAYER2, NO_PLAYER, GameState
-from agents.common import connected_four, check_end_state, apply_player_action, check_open_columns
+from functools import lru_cache
+from time import time
+from typing import Optional, Tuple, Union
+from agents.common import BoardPiece, PlayerAction, SavedState, PLAYER1, PLAYER2, NO_PLAYER, GameState, Board
+from agents.common import line_windows
+from agents.common import TranspositionTable
 
 #num_rows = board.shape[0]
 #num_columns = board.shape[1]
 
+WIN_SCORE = 100000  # score of a win on the board, minus the plies it takes to get there
+SECONDS = 1.0  # default thinking time per move
+TABLE_SIZE = 2**18  # entries of the transposition table of a move
+
 def generate_move(
-	board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState]
+	board: np.ndarray, player: BoardPiece, saved_state: Optional[SavedState],
+	seconds: float = SECONDS, max_depth: Optional[int] = None
 ) -> Tuple[PlayerAction, Optional[SavedState]]:
-
-	alpha = -math.inf
-	beta = math.inf
-	depth = 4
+	'''
+	Searches deeper and deeper until the time is up and plays the best move of the deepest completed search
+	:param board: current state of board
+	:param player: agent
+	:param saved_state: returned unchanged
+	:param seconds: thinking time
+	:param max_depth: depth at which to stop deepening, at least 1 (default: until the board is full)
+	:return: move, saved_state
+	'''
 
 	# Choose a valid, non-full column that maximizes score and return it as `action`
-	PlayerAction = minimax(board, depth, alpha, beta, player, True)[0]
+	action = iterative_deepening(board, player, seconds, max_depth)[0]
+	if action is None: #the depth 1 search always completes, so only a full board has no move
+		raise ValueError("no move left on a full board")
 
-	return PlayerAction, saved_state
+	return PlayerAction(action), saved_state
 
 def center_column_score(board: np.ndarray, player: BoardPiece) -> int:
 	'''
@@ -98,9 +113,6 @@ def heuristic(board: np.ndarray, player: BoardPiece) -> int:
 	:return: score that can be achieve by playing open position
 	'''
 
-	num_rows = board.shape[0]
-	num_columns = board.shape[1]
-
 	score = 0
 
 	#Prefer moves in the center column
@@ -109,94 +121,403 @@ def heuristic(board: np.ndarray, player: BoardPiece) -> int:
 	#Prefer moves in even or odd rows depending on player
 	score += even_odd_row_scores(board, player)
 
-	# first check horizontal
-	for row in range(num_rows): #loop through every row
-		row = board[row,:]
-		#now loop through each column and check 4 adjacent spots
-		for col in range(num_columns-3): #only need to loop through first 4 cols, since adjacent_4 would touch (j+3)
-			adjacent_four = list(row[col:col+4]) #convert to list to apply count() later
-			#now count the number of pieces for each player
-			score += adjacent_score(adjacent_four,player)
-
-	# vertical
-	for col in range(num_columns):
-		col = board[:,col]
-		for row in range(num_rows-3):
-			adjacent_four = list(col[row:row+4])
-			score += adjacent_score(adjacent_four, player)
-
-	#score positive sloped diagonal
-	for row in range(num_rows-3): #rows
-		for col in range(num_columns-3): # cols
-			adjacent_four = [board[row+i,col+i] for i in range(4)]
-			score += adjacent_score(adjacent_four,player)
-
-	#score negative diagonal
-	for row in range(num_rows-3): #rows
-		for col in range(num_columns-3): # cols
-			adjacent_four = [board[row + 3 - i, col + i] for i in range(4)] #col increases but row decreases
-			score += adjacent_score(adjacent_four, player)
+	# gather the 4 adjacent spots of every row, column and diagonal window with the precomputed index table
+	for adjacent_four in board.ravel()[line_windows(board.shape, 4)]:
+		#convert to list to apply count() later, then count the number of pieces for each player
+		score += adjacent_score(list(adjacent_four), player)
 
 	return score
 
-def minimax(board: np.ndarray, depth: int, alpha: int, beta: int, player: BoardPiece, maximizing_player: bool) -> Tuple[int, int]:
+@lru_cache(maxsize=None)
+def window_score_table(player: BoardPiece) -> np.ndarray:
 	'''
-	Returns a column where action should be placed and the min and max score for GameState
+	Scores of adjacent_score for every content of a window, so that the heuristic can look them up
+	:param player: agent
+	:return: read-only table, [own, opponent] = score of a window with that many pieces of player and of the opponent
+	'''
+	opponent_player = PLAYER2 if player == PLAYER1 else PLAYER1
+	table = np.zeros((5, 5), dtype=np.int64)
+	for own in range(5):
+		for other in range(5 - own):
+			table[own, other] = adjacent_score([player] * own + [opponent_player] * other + [NO_PLAYER] * (4 - own - other), player)
+	table.flags.writeable = False
+	return table
+
+@lru_cache(maxsize=None)
+def cell_weights(shape: Tuple[int, int], player: BoardPiece) -> np.ndarray:
+	'''
+	Score of a piece of player on each cell: center_column_score and even_odd_row_scores per piece
+	:param shape: (rows, columns) of the board
+	:param player: agent
+	:return: read-only array of the board's shape
+	'''
+	weights = np.zeros(shape, dtype=np.int64)
+	weights[:, int(shape[1] / 2)] += 3
+	weights[0 if player == PLAYER1 else 1::2, :] += 2
+	weights.flags.writeable = False
+	return weights
+
+def heuristic_batch(boards: np.ndarray, player: BoardPiece) -> np.ndarray:
+	'''
+	heuristic for a stack of boards in one call, e.g. all children of a node: the windows of all
+	boards are gathered with one index table and their scores are looked up by piece counts
+	:param boards: boards of shape (number of boards, rows, columns)
+	:param player: player who wants to maximize score
+	:return: score of each board, equal to heuristic(board, player)
+	'''
+	boards = np.asarray(boards)
+	count, rows, columns = boards.shape
+	pieces = boards.reshape(count, rows * columns)[:, line_windows((rows, columns), 4)]
+	own = np.count_nonzero(pieces == player, axis=2)
+	other = np.count_nonzero(pieces != NO_PLAYER, axis=2) - own
+	windows = window_score_table(player)[own, other].sum(axis=1)
+	weights = np.where(boards == player, cell_weights((rows, columns), player), 0).sum(axis=(1, 2))
+	return windows + weights
+
+class IncrementalHeuristic:
+	"""
+	heuristic(board, player) kept up to date while moves are played and taken back: the pieces of
+	both players are counted per window, so a move only rescores the windows through its cell.
+	"""
+	def __init__(self, board: np.ndarray, player: BoardPiece):
+		'''
+		:param board: position to start from
+		:param player: agent (whose score is kept)
+		'''
+		self.player = player
+		self.columns = board.shape[1]
+		windows = line_windows(board.shape, 4)
+		#windows through each cell
+		self.cell_windows = [[] for _ in range(board.size)]
+		for window, cells in enumerate(windows.tolist()):
+			for cell in cells:
+				self.cell_windows[cell].append(window)
+		self.scores = window_score_table(player).tolist()
+		self.weights = cell_weights(board.shape, player).ravel().tolist()
+		#pieces of player (own) and of the opponent (other) in each window
+		pieces = board.ravel()[windows]
+		own = np.count_nonzero(pieces == player, axis=1)
+		other = np.count_nonzero((pieces != player) & (pieces != NO_PLAYER), axis=1)
+		self.own, self.other = own.tolist(), other.tolist()
+		self.score = int(window_score_table(player)[own, other].sum() + self.weights_of(board))
+
+	def weights_of(self, board: np.ndarray) -> int:
+		'''
+		:return: sum of the cell weights of the pieces of player on board
+		'''
+		return int(cell_weights(board.shape, self.player)[board == self.player].sum())
+
+	def play(self, row: int, column: int, piece: BoardPiece):
+		'''
+		Updates the score for a piece dropped into (row, column)
+		'''
+		self.update(row * self.columns + column, piece, 1)
+
+	def undo(self, row: int, column: int, piece: BoardPiece):
+		'''
+		Updates the score for a piece taken back from (row, column)
+		'''
+		self.update(row * self.columns + column, piece, -1)
+
+	def update(self, cell: int, piece: BoardPiece, change: int):
+		'''
+		Rescores the windows through cell after change (1 or -1) pieces of piece were put on it
+		'''
+		scores, own, other = self.scores, self.own, self.other
+		counts = own if piece == self.player else other
+		score = self.score
+		for window in self.cell_windows[cell]:
+			score -= scores[own[window]][other[window]]
+			counts[window] += change
+			score += scores[own[window]][other[window]]
+		if piece == self.player:
+			score += change * self.weights[cell]
+		self.score = score
+
+class SearchTimeout(Exception):
+	"""
+	Raised inside a search when its deadline has passed
+	"""
+
+class MoveOrdering:
+	"""
+	Order in which Negamax tries the moves of a node: the transposition table's best move first,
+	then the killer moves of the ply (moves that caused a cutoff in a sibling position), then by
+	history score (cutoffs of the move anywhere in the search, weighted by depth squared) and
+	finally center columns before outer ones. Each part can be switched off.
+	"""
+	def __init__(self, columns: int = 7, center: bool = True, killers: int = 2, history: bool = True):
+		'''
+		:param columns: number of columns of the board
+		:param center: static center-first order (otherwise left to right)
+		:param killers: number of killer moves kept per ply (0 for none)
+		:param history: order by history score
+		'''
+		middle = (columns - 1) / 2
+		self.rank = [abs(col - middle) if center else col for col in range(columns)]
+		self.killers_per_ply = killers
+		self.killers = {}  # ply -> killer moves, latest first
+		self.use_history = history
+		self.history = [[0] * columns, [0] * columns]  # history[player - 1][column]
+
+	def order(self, moves: Tuple[int, ...], player: BoardPiece, ply: int, table_move: int = -1) -> Tuple[int, ...]:
+		'''
+		:param moves: legal moves of the node
+		:param player: player to move
+		:param ply: distance of the node from the root
+		:param table_move: best move stored in the transposition table (-1 if none)
+		:return: moves in the order they should be searched
+		'''
+		killers = self.killers.get(ply, ())
+		history = self.history[player - 1] if self.use_history else None
+		def key(col):
+			killer = killers.index(col) if col in killers else len(killers)
+			return (col != table_move, killer, -history[col] if history else 0, self.rank[col])
+		return tuple(sorted(moves, key=key))
+
+	def cutoff(self, column: int, player: BoardPiece, ply: int, depth: int):
+		'''
+		Learns from a move that caused a beta cutoff
+		:param column: the move
+		:param player: player who made it
+		:param ply: distance of its node from the root
+		:param depth: remaining depth of its node
+		'''
+		if self.killers_per_ply:
+			killers = self.killers.setdefault(ply, [])
+			if column not in killers:
+				killers.insert(0, column)
+				del killers[self.killers_per_ply:]
+		if self.use_history:
+			self.history[player - 1][column] += depth * depth
+
+class Negamax:
+	"""
+	Alpha-beta search in negamax form: every node is scored for the player to move, so both players
+	share one branch. Leaves are scored with the heuristic of the searching player (negated on the
+	opponent's turn), wins with WIN_SCORE minus the number of plies to the win.
+	"""
+	CHECK_EVERY = 1024  # nodes between two looks at the clock
+
+	def __init__(self, player: BoardPiece, table: Optional[TranspositionTable] = None,
+				 deadline: Optional[float] = None, ordering: Optional[MoveOrdering] = None, incremental: bool = True):
+		'''
+		:param player: player the search is for (whose heuristic scores the leaves)
+		:param table: transposition table (None to search without)
+		:param deadline: time() at which SearchTimeout is raised (None for no limit)
+		:param ordering: move ordering (None for left to right, with the table's best move first)
+		:param incremental: score the leaves with an IncrementalHeuristic instead of calling heuristic
+		'''
+		self.player = player
+		self.table = table
+		self.deadline = deadline
+		self.ordering = ordering
+		self.incremental = incremental
+		self.evaluator = None  # IncrementalHeuristic of the running search, set up at the root
+		self.root_move = None  # best move at the root of the last search
+		#counters
+		self.nodes = 0  # nodes searched
+		self.expanded = 0  # nodes whose moves were searched
+		self.cutoffs = 0  # expanded nodes left early by a beta cutoff
+		self.first_move_cutoffs = 0  # cutoffs by the first move searched
+		self.nodes_per_depth = {}  # depth of a completed iterative deepening search -> its nodes
+
+	@property
+	def cutoff_rate(self) -> float:
+		'''
+		:return: share of the expanded nodes that were cut off
+		'''
+		return self.cutoffs / self.expanded if self.expanded else 0.0
+
+	@property
+	def first_move_cutoff_rate(self) -> float:
+		'''
+		:return: share of the cutoffs that came from the first move searched (1 for perfect ordering)
+		'''
+		return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+	def negamax(self, board: Board, depth: int, alpha: float, beta: float, player: BoardPiece, ply: int = 0) -> float:
+		'''
+		Returns the score of the position for player (the player to move)
+		:param board: position, moves are played and taken back on it
+		:param depth: remaining depth
+		:param alpha: score player is already sure of
+		:param beta: score the opponent is already sure of
+		:param player: player to move
+		:param ply: distance from the root (the best root move is kept in root_move)
+		:return: exact score if it lies between alpha and beta, otherwise a bound on the side it fell out
+		'''
+		self.nodes += 1
+		if ply == 0 and self.incremental:
+			self.evaluator = IncrementalHeuristic(board.state, self.player)
+		if self.deadline is not None and self.nodes % self.CHECK_EVERY == 0 and time() > self.deadline:
+			raise SearchTimeout()
+		opponent = PLAYER2 if player == PLAYER1 else PLAYER1
+
+		#only the player who made the last move can have won (only the lines through it are checked)
+		if board.connected_four(opponent):
+			return -(WIN_SCORE - ply)
+		if board.is_full():
+			return 0
+		if depth == 0:
+			score = heuristic(board.state, self.player) if self.evaluator is None else self.evaluator.score
+			return score if player == self.player else -score
+
+		alpha_orig = alpha
+		table_move = -1
+		if self.table is not None:
+			entry = self.table.lookup(board.hash)
+			if entry is not None:
+				table_move = entry.move
+				#results of at least this depth narrow the window (not at the root, which needs a move)
+				if entry.depth >= depth and ply > 0:
+					value = from_table(entry.value, ply)
+					if entry.flag == TranspositionTable.EXACT:
+						return value
+					elif entry.flag == TranspositionTable.LOWER:
+						alpha = max(alpha, value)
+					else:
+						beta = min(beta, value)
+					if alpha >= beta:
+						return value
+
+		#principal variation ordering: the best move of the previous (shallower) search comes first
+		moves = board.legal_moves()
+		if self.ordering is not None:
+			moves = self.ordering.order(moves, player, ply, table_move)
+		elif table_move in moves:
+			moves = (table_move,) + tuple(col for col in moves if col != table_move)
+
+		self.expanded += 1
+		score = -math.inf
+		best_move = None
+		evaluator = self.evaluator
+		for index, column in enumerate(moves):
+			row = board.play(column, player)
+			if evaluator is not None:
+				evaluator.play(row, column, player)
+			next_score = -self.negamax(board, depth - 1, -beta, -alpha, opponent, ply + 1)
+			board.undo()
+			if evaluator is not None:
+				evaluator.undo(row, column, player)
+			if next_score > score:
+				score = next_score
+				best_move = column
+			alpha = max(alpha, score)
+			if alpha >= beta: #don't evaluate more options down this path of tree
+				self.cutoffs += 1
+				if index == 0:
+					self.first_move_cutoffs += 1
+				if self.ordering is not None:
+					self.ordering.cutoff(column, player, ply, depth)
+				break
+
+		if self.table is not None:
+			if score <= alpha_orig:
+				flag = TranspositionTable.UPPER
+			elif score >= beta:
+				flag = TranspositionTable.LOWER
+			else:
+				flag = TranspositionTable.EXACT
+			self.table.store(board.hash, depth, to_table(score, ply), flag, best_move)
+		if ply == 0:
+			self.root_move = best_move
+		return score
+
+	def iterative_deepening(self, board: Board, seconds: Optional[float] = SECONDS,
+							max_depth: Optional[int] = None) -> Tuple[Optional[int], float, int]:
+		'''
+		Searches board for self.player to depth 1, 2, ... until the time is up, each search starts with the
+		best moves of the one before (stored in the table). The depth 1 search always completes.
+		:param board: current state of board, the player to move is self.player
+		:param seconds: thinking time (None for no limit)
+		:param max_depth: depth at which to stop deepening, at least 1 (default: until the board is full)
+		:return: best move, its score and the depth of the deepest completed search (None, 0, 0 on a full board)
+		'''
+		if max_depth is not None and max_depth < 1:
+			raise ValueError("max_depth must be at least 1")
+		deadline = None if seconds is None else time() + seconds
+		empty = board.rows * board.columns - board.move_count
+		max_depth = empty if max_depth is None else min(max_depth, empty)
+
+		move, score, completed = None, 0, 0
+		played = len(board.history)
+		self.deadline = None
+		for depth in range(1, max_depth + 1):
+			nodes = self.nodes
+			try:
+				score = self.negamax(board, depth, -math.inf, math.inf, self.player)
+			except SearchTimeout:
+				#take back the moves of the interrupted search
+				while len(board.history) > played:
+					board.undo()
+				break
+			move, completed = self.root_move, depth
+			self.nodes_per_depth[depth] = self.nodes - nodes
+			#won or lost for sure, deeper searches won't change the move
+			if abs(score) >= WIN_SCORE - 100:
+				break
+			self.deadline = deadline
+		return move, score, completed
+
+def to_table(score: float, ply: int) -> float:
+	'''
+	Win scores count the plies from the root, in the table they count them from the stored position
+	'''
+	if abs(score) >= WIN_SCORE - 100:
+		return score + ply if score > 0 else score - ply
+	return score
+
+def from_table(score: float, ply: int) -> float:
+	'''
+	Inverse of to_table for a position ply plies from the root
+	'''
+	if abs(score) >= WIN_SCORE - 100:
+		return score - ply if score > 0 else score + ply
+	return score
+
+def iterative_deepening(board: Union[np.ndarray, Board], player: BoardPiece, seconds: Optional[float] = SECONDS,
+						max_depth: Optional[int] = None, table: Optional[TranspositionTable] = None,
+						ordering: Optional[MoveOrdering] = None) -> Tuple[Optional[int], float, int]:
+	'''
+	Runs Negamax.iterative_deepening with one transposition table for all depths
 	:param board: current state of board
+	:param player: player to move
+	:param seconds: thinking time (None for no limit)
+	:param max_depth: depth at which to stop deepening, at least 1 (default: until the board is full)
+	:param table: transposition table (default: a new one with TABLE_SIZE entries)
+	:param ordering: move ordering (default: a new MoveOrdering with all parts on)
+	:return: best move, its score and the depth of the deepest completed search
+	'''
+	board = Board(board.state if isinstance(board, Board) else board)
+	table = TranspositionTable(TABLE_SIZE) if table is None else table
+	ordering = MoveOrdering(board.columns) if ordering is None else ordering
+	return Negamax(player, table, ordering=ordering).iterative_deepening(board, seconds, max_depth)
+
+def minimax(board: Union[np.ndarray, Board], depth: int, alpha: int, beta: int, player: BoardPiece,
+			maximizing_player: bool) -> Tuple[int, int]:
+	'''
+	Returns a column where action should be placed and the min and max score for GameState
+	(a fixed-depth Negamax search without transposition table)
+	:param board: current state of board (an ndarray is wrapped into a Board once at the root)
 	:param depth: depth of search tree
 	:param maximizingPlayer: True if we want to max for player
 	:return: min or max score for action of player
 	'''
 
+	#play and take back moves on a single Board instead of copying the board at every node
+	if not isinstance(board, Board):
+		board = Board(board)
+
 	#check which player is the agent so that we don't max/min for wrong player
 	if player == PLAYER1:
 		opponent_player = PLAYER2
 	else:
 		opponent_player = PLAYER1
 
-	#check which columns are currently open
-	open_cols = np.asarray(check_open_columns(board))
-
-	#check if depth is 0
-	if depth == 0:
-		score = heuristic(board, player)
-		return None, score
-
-	#check if we're at a leaf/terminal node
-	if check_end_state(board,player) != GameState.STILL_PLAYING:
-		if connected_four(board, player): #agent won
-			return None, 100000
-		if connected_four(board, opponent_player): #opponent won
-			return None, -100000
-		else: #must be a draw
-			return None, 0
-
+	search = Negamax(player)
 	if maximizing_player: #get max score for agent
-		score = -math.inf
-		for column in open_cols:
-			#now simulate making a move and check what score it would get, save the original board in board
-			board, board_copy = apply_player_action(board, column, player, True)
-			# recursive call to minimax with depth-1 with board_copy so board isn't modified
-			next_score = minimax(board_copy, depth-1, alpha, beta, player, False)[1] #only get the score
-			#if the score is better save score and column
-			if next_score > score:
-				score = next_score
-				action_column = column
-			#evaluate alpha for early stopping
-			alpha = max(alpha, score)
-			if alpha >= beta: #don't evaluate more options down this path of tree
-				break
-		return action_column, score
-
-	else:
-		score = math.inf
-		for column in open_cols:
-			board, action_board = apply_player_action(board, column, opponent_player, True)
-			next_score = minimax(action_board, depth-1, alpha, beta, player, True)[1]
-			if next_score < score:
-				score = next_score
-				action_column = column
-			beta = min(beta, score) #here we want to minimize since we're opponent player
-			if alpha >= beta:
-				break
-		return action_column, score
\ No newline at end of file
+		score = search.negamax(board, depth, alpha, beta, player)
+	else: #the opponent minimizes the agent's score, which maximizes its own
+		score = -search.negamax(board, depth, -beta, -alpha, opponent_player)
+	return search.root_move, score
@@ -0,0 +1,34 @@
+"""
+Builds agents._kernels_aot, an ahead-of-time compiled extension module of the kernels in
+agents.kernels (compiled from the same python sources, see AOT_SIGNATURES):
+
+	python -m agents.build_kernels
+
+Rebuild it whenever agents/kernels.py or the functions it compiles change, or delete the
+built module to go back to the jitted kernels.
+"""
+import os
+import sys
+from numba.pycc import CC
+
+from agents import kernels
+
+
+def build(output_dir: str = None, verbose: bool = False) -> str:
+	"""
+	Compiles the kernels listed in kernels.AOT_SIGNATURES into an extension module
+	:param output_dir: where to put the module, the agents package by default
+	:param verbose: print the compiler output
+	:return: path of the built module
+	"""
+	cc = CC(kernels.AOT_MODULE.rsplit('.', 1)[1])
+	cc.output_dir = output_dir or os.path.dirname(os.path.abspath(kernels.__file__))
+	cc.verbose = verbose
+	for name, signature in kernels.AOT_SIGNATURES.items():
+		cc.export(name, signature)(getattr(kernels, name).py_func)
+	cc.compile()
+	return os.path.join(cc.output_dir, cc.output_file)
+
+
+if __name__ == '__main__':
+	print(f"Built {build(verbose='-v' in sys.argv[1:])}")
@@ -1,8 +1,11 @@
+import os
 import numpy as np
+from abc import ABC, abstractmethod
 from enum import Enum
-from typing import Optional, Callable, Tuple
-from numba import njit
-from scipy.signal.sigtools import _convolve2d
+from functools import lru_cache
+from importlib import import_module
+from timeit import timeit
+from typing import Optional, Callable, Tuple, NamedTuple
 
 
 BoardPiece = np.int8  # The data type (dtype) of the board
@@ -33,6 +36,60 @@ def initialize_game_state() -> np.ndarray:
 	"""
 	return np.zeros((6, 7), dtype=BoardPiece)
 
+@lru_cache(maxsize=None)
+def line_windows(shape: Tuple[int, int] = (6, 7), n: int = CONNECT_N) -> np.ndarray:
+	"""
+	Returns the flat indices of every line of n adjacent cells (horizontal, vertical and both
+	diagonals) on a board of the given shape. The table is built once per (shape, n), so
+	board.ravel()[line_windows(board.shape)] gathers all windows of a board in one go.
+	:param shape: (rows, columns) of the board
+	:param n: number of cells per window
+	:return: read-only ndarray of shape (number of windows, n)
+	"""
+	rows, cols = shape
+	index = np.arange(rows * cols).reshape(shape)
+	windows = []
+	for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+		for row in range(rows):
+			for col in range(cols):
+				end_row, end_col = row + (n - 1) * d_row, col + (n - 1) * d_col
+				if 0 <= end_row < rows and 0 <= end_col < cols:
+					windows.append([index[row + i * d_row, col + i * d_col] for i in range(n)])
+	windows = np.array(windows, dtype=np.intp).reshape(-1, n)
+	windows.flags.writeable = False
+	return windows
+
+#all 69 windows of CONNECT_N cells on the standard board
+WINDOWS = line_windows((6, 7), CONNECT_N)
+
+ZOBRIST_SEED = 4  # fixed so that hashes are the same in every process
+
+@lru_cache(maxsize=None)
+def zobrist_keys(shape: Tuple[int, int] = (6, 7)) -> np.ndarray:
+	"""
+	Returns the random Zobrist keys for a board of the given shape. The hash of a board is the
+	xor of keys[player - 1, row, col] over all its pieces, so playing or taking back a piece
+	updates the hash with a single xor.
+	:param shape: (rows, columns) of the board
+	:return: read-only uint64 ndarray of shape (2, rows, columns)
+	"""
+	rng = np.random.default_rng(ZOBRIST_SEED)
+	keys = rng.integers(1, 2**63, size=(2,) + tuple(shape), dtype=np.uint64)
+	keys.flags.writeable = False
+	return keys
+
+def zobrist_hash(board: np.ndarray) -> int:
+	"""
+	Computes the Zobrist hash of a board from scratch
+	:param board: current state of board
+	:return: hash of the position as a python int
+	"""
+	keys = zobrist_keys(board.shape)
+	key = 0
+	for player in (PLAYER1, PLAYER2):
+		key ^= int(np.bitwise_xor.reduce(keys[player - 1][board == player]))
+	return key
+
 def pretty_print_board(board: np.ndarray) -> str:
 	"""
 	Should return `board` converted to a human readable string representation,
@@ -126,54 +183,63 @@ def connected_four(
 	If desired, the last action taken (i.e. last column played) can be provided
 	for potential speed optimisation.
 	"""
+	if last_action is not None:
+		return connected_four_local(board, player, last_action)
 
-	#loop over all rows and columns and check the column, row, and diagonal for adjacent 4 (only for half the board)
-	for row in range(board.shape[0]):
-		for column in range(board.shape[1]):
-			#check row -- only half of each column, if there are 4 connected in a column they must reach up to first 4
-			if column <= 3 and board[row, column] == player and board[row, column + 1] == player and board[row, column + 2] == player and board[row, column + 3] == player:
-				return True
-			#check column -- up to first 4 pieces
-			if row <= 2 and board[row, column] == player and board[row + 1, column] == player and board[row + 2, column] == player and board[row + 3, column] == player:
-				return True
-			#check upper left - lower right diagonal -> this checks all possible diagonals bc looping over row and column
-			if row <= 2 and column >= 3 and board[row, column] == player and board[row + 1, column - 1] == player and board[row + 2, column - 2] == player and board[row + 3, column - 3] == player:
-				return True
-			#check lower right upper left diagonal
-			if row <= 2 and column <= 3 and board[row, column] == player and board[row + 1, column + 1] == player and board[row + 2, column + 2] == player and board[row + 3, column + 3] == player:
-				return True
-
-	#if no connected 4 are found
-	return False
+	#gather every row, column and diagonal window at once and check if one is filled by player
+	windows = board.ravel()[line_windows(board.shape)]
+	return bool(np.any(np.all(windows == player, axis=1)))
 
-@njit()
-def connected_four_iter(
-	board: np.ndarray, player: BoardPiece, _last_action: Optional[PlayerAction] = None
-) -> bool:
+def connected_four_local(board: np.ndarray, player: BoardPiece, last_action: PlayerAction) -> bool:
+	"""
+	Checks only the four lines (horizontal, vertical and both diagonals) through the top
+	piece of column last_action. If the game wasn't already won before `player` dropped that
+	piece, this gives the same answer as scanning the whole board.
+	:param board: current state of board
+	:param player: player who made the last action
+	:param last_action: column the last piece was dropped into
+	:return: True if the last piece completed CONNECT_N in a line, False otherwise
+	"""
 	rows, cols = board.shape
-	rows_edge = rows - CONNECT_N + 1
-	cols_edge = cols - CONNECT_N + 1
-
-	for i in range(rows):
-		for j in range(cols_edge):
-			if np.all(board[i, j:j+CONNECT_N] == player):
-				return True
-
-	for i in range(rows_edge):
-		for j in range(cols):
-			if np.all(board[i:i+CONNECT_N, j] == player):
-				return True
-
-	for i in range(rows_edge):
-		for j in range(cols_edge):
-			block = board[i:i+CONNECT_N, j:j+CONNECT_N]
-			if np.all(np.diag(block) == player):
-				return True
-			if np.all(np.diag(block[::-1, :]) == player):
-				return True
-
+	col = int(last_action)
+
+	#find the piece that was just dropped (highest piece in the column)
+	row = rows - 1
+	while row >= 0 and board[row, col] == NO_PLAYER:
+		row -= 1
+	if row < 0 or board[row, col] != player:
+		return False
+
+	#walk away from the piece in both directions of each line and count the pieces of player
+	for d_row, d_col in ((0, 1), (1, 0), (1, 1), (1, -1)):
+		count = 1
+		r, c = row + d_row, col + d_col
+		while 0 <= r < rows and 0 <= c < cols and board[r, c] == player:
+			count += 1
+			r, c = r + d_row, c + d_col
+		r, c = row - d_row, col - d_col
+		while 0 <= r < rows and 0 <= c < cols and board[r, c] == player:
+			count += 1
+			r, c = r - d_row, c - d_col
+		if count >= CONNECT_N:
+			return True
 	return False
 
+def make_rng_state(seed: Optional[int] = None) -> np.ndarray:
+	"""
+	Creates the state of the xorshift random number generator used by the playout kernels
+	:param seed: seed for reproducible playouts, None to seed from the OS
+	:return: uint64 ndarray of length 1, advanced in place by every playout
+	"""
+	if seed is None:
+		seed = int.from_bytes(np.random.bytes(8), 'little')
+	#splitmix64 scrambling, so that neighbouring seeds give unrelated (and non-zero) states
+	x = (int(seed) + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+	x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+	x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+	x ^= x >> 31
+	return np.array([x or 1], dtype=np.uint64)
+
 #glob variables required for connected_four_convolve
 col_kernel = np.ones((CONNECT_N, 1), dtype=BoardPiece)
 row_kernel = np.ones((1, CONNECT_N), dtype=BoardPiece)
@@ -181,8 +247,14 @@ dia_l_kernel = np.diag(np.ones(CONNECT_N, dtype=BoardPiece))
 dia_r_kernel = np.array(np.diag(np.ones(CONNECT_N, dtype=BoardPiece))[::-1, :])
 
 def connected_four_convolve(
-	board: np.ndarray, player: BoardPiece, _last_action: Optional[PlayerAction] = None
+	board: np.ndarray, player: BoardPiece, last_action: Optional[PlayerAction] = None
 ) -> bool:
+	if last_action is not None:
+		return connected_four_local(board, player, last_action)
+
+	#scipy is slow to import, so only import it once this backend is actually used
+	from scipy.signal import convolve2d
+
 	board = board.copy()
 
 	other_player = BoardPiece(player % 2 + 1)
@@ -190,7 +262,7 @@ def connected_four_convolve(
 	board[board == player] = BoardPiece(1)
 
 	for kernel in (col_kernel, row_kernel, dia_l_kernel, dia_r_kernel):
-		result = _convolve2d(board, kernel, 1, 0, 0, BoardPiece(0))
+		result = convolve2d(board, kernel, mode='valid')
 		if np.any(result == CONNECT_N):
 			return True
 	return False
@@ -210,18 +282,567 @@ def check_end_state(
 	Returns the current game state for the current `player`, i.e. has their last
 	action won (GameState.IS_WIN) or drawn (GameState.IS_DRAW) the game,
 	or is play still on-going (GameState.STILL_PLAYING)?
+	If last_action is given, only the lines through the last piece are checked for a win.
 	"""
-	if (connected_four_convolve(board,player,last_action)):
+	if win_check(board, player, last_action):
 		return GameState.IS_WIN
 	elif check_board_full(board):
 		return GameState.IS_DRAW
 	else:
 		return GameState.STILL_PLAYING
 
+def connected_four_batch(boards: np.ndarray, players) -> np.ndarray:
+	"""
+	Vectorized connected_four for a stack of boards
+	:param boards: ndarray of shape (N, rows, columns)
+	:param players: player to check for each board, shape (N,) or a single BoardPiece for all boards
+	:return: bool ndarray of shape (N,), True where players[i] has CONNECT_N in a line on boards[i]
+	"""
+	boards = np.asarray(boards)
+	players = np.broadcast_to(np.asarray(players, dtype=BoardPiece), boards.shape[:1])
+	pieces = boards.reshape(boards.shape[0], -1) == players[:, None]
+	#gather all windows of all boards in one go: shape (N, number of windows, CONNECT_N)
+	windows = pieces[:, line_windows(boards.shape[1:])]
+	return np.any(np.all(windows, axis=2), axis=1)
+
+def check_end_state_batch(boards: np.ndarray, players) -> np.ndarray:
+	"""
+	Vectorized check_end_state for a stack of boards
+	:param boards: ndarray of shape (N, rows, columns)
+	:param players: player to check for each board, shape (N,) or a single BoardPiece for all boards
+	:return: int8 ndarray of shape (N,) holding GameState values (IS_WIN, IS_DRAW or STILL_PLAYING)
+	"""
+	boards = np.asarray(boards)
+	won = connected_four_batch(boards, players)
+	full = np.all(boards[:, -1, :] != NO_PLAYER, axis=1)
+	states = np.full(boards.shape[0], GameState.STILL_PLAYING.value, dtype=np.int8)
+	states[full] = GameState.IS_DRAW.value
+	states[won] = GameState.IS_WIN.value
+	return states
+
 def check_open_columns(board: np.ndarray) -> list:
 	'''
 	Returns list of all open columns by checking which columns in last row are equal to NO_PLAYER
 	:param board: current state of board
 	:return: list of open columns
 	'''
-	return list(np.argwhere(board[board.shape[0] - 1, :] == NO_PLAYER).flatten())
\ No newline at end of file
+	return list(np.argwhere(board[board.shape[0] - 1, :] == NO_PLAYER).flatten())
+
+
+class Board:
+	"""
+	Stateful board that keeps track of the column heights, the number of moves and the moves
+	played so far, so that moves can be played and taken back in place instead of copying the
+	board. Board.state is an ordinary (rows, columns) ndarray of BoardPiece and can be passed
+	to any function that takes a board, e.g. a GenMove.
+	"""
+	def __init__(self, board: Optional[np.ndarray] = None):
+		self.state = initialize_game_state() if board is None else np.array(board, dtype=BoardPiece)
+		self.rows, self.columns = self.state.shape
+		self.heights = [int(h) for h in np.count_nonzero(self.state != NO_PLAYER, axis=0)]
+		self.move_count = sum(self.heights)
+		self.history = []  # columns played since the Board was created
+		self._legal_moves = tuple(col for col in range(self.columns) if self.heights[col] < self.rows)
+		self._keys = zobrist_keys(self.state.shape).tolist()  # python ints xor faster than np.uint64
+		self.hash = zobrist_hash(self.state)  # Zobrist hash, kept up to date by play and undo
+
+	@property
+	def last_move(self) -> Optional[PlayerAction]:
+		"""
+		Column of the last move played on this Board (None if there is none)
+		"""
+		return self.history[-1] if self.history else None
+
+	def copy(self) -> 'Board':
+		"""
+		Returns an independent copy of the Board, including its move history
+		"""
+		other = Board(self.state)
+		other.history = list(self.history)
+		return other
+
+	def is_legal(self, action: PlayerAction) -> bool:
+		"""
+		:return: True if column action isn't full yet
+		"""
+		return 0 <= action < self.columns and self.heights[action] < self.rows
+
+	def legal_moves(self) -> tuple:
+		"""
+		:return: open columns in increasing order (only recomputed when a column fills up or empties)
+		"""
+		return self._legal_moves
+
+	def is_full(self) -> bool:
+		"""
+		:return: True if there's no empty spot left on the board
+		"""
+		return self.move_count == self.rows * self.columns
+
+	def play(self, action: PlayerAction, player: BoardPiece) -> int:
+		"""
+		Drops a piece of player into column action (in place)
+		:return: row the piece landed in
+		"""
+		row = self.heights[action]
+		self.state[row, action] = player
+		self.hash ^= self._keys[player - 1][row][action]
+		self.heights[action] = row + 1
+		self.move_count += 1
+		self.history.append(action)
+		if row + 1 == self.rows:
+			self._legal_moves = tuple(col for col in self._legal_moves if col != action)
+		return row
+
+	def undo(self) -> PlayerAction:
+		"""
+		Takes back the last move played on this Board (in place)
+		:return: column of the move that was taken back
+		"""
+		action = self.history.pop()
+		row = self.heights[action] - 1
+		self.hash ^= self._keys[self.state[row, action] - 1][row][action]
+		self.state[row, action] = NO_PLAYER
+		self.heights[action] = row
+		self.move_count -= 1
+		if row + 1 == self.rows:
+			self._legal_moves = tuple(sorted(self._legal_moves + (action,)))
+		return action
+
+	def connected_four(self, player: BoardPiece) -> bool:
+		"""
+		connected_four for the current state, only checking the lines through the last move if it is known
+		"""
+		return win_check(self.state, player, self.last_move)
+
+	def end_state(self, player: BoardPiece) -> GameState:
+		"""
+		check_end_state for the current state, only checking the lines through the last move if it is known
+		"""
+		if self.connected_four(player):
+			return GameState.IS_WIN
+		elif self.is_full():
+			return GameState.IS_DRAW
+		else:
+			return GameState.STILL_PLAYING
+
+class TTEntry(NamedTuple):
+	depth: int
+	value: float
+	flag: int
+	move: int
+
+class ZobristTable(ABC):
+	"""
+	Base of the fixed-size tables keyed by Zobrist hash (see zobrist_hash and Board.hash). Entries
+	live in preallocated arrays, so the memory footprint is fixed when the table is created. The
+	slot of a position is its hash modulo the table size, which is a power of two. Subclasses
+	allocate their entry arrays in allocate, with one of them (marks) holding -1 in empty slots,
+	and decide in store which entry a slot keeps when two positions share it.
+	"""
+	NAME = 'zobrist table'
+
+	def __init__(self, size: int):
+		"""
+		:param size: number of entries, rounded down to a power of two
+		"""
+		if size < 1:
+			raise ValueError(f"{self.NAME} needs at least one entry")
+		size = 1 << (int(size).bit_length() - 1)
+		self.size = size
+		self.mask = size - 1
+		self.keys = np.zeros(size, dtype=np.uint64)
+		self.marks = self.allocate(size)
+
+	@abstractmethod
+	def allocate(self, size: int) -> np.ndarray:
+		"""
+		Allocates the entry arrays of a subclass
+		:return: array that is -1 exactly in the empty slots
+		"""
+
+	def __len__(self) -> int:
+		return int(np.count_nonzero(self.marks >= 0))
+
+	def clear(self):
+		"""
+		Empties the table
+		"""
+		self.marks[:] = -1
+
+	def find(self, key: int) -> Optional[int]:
+		"""
+		:param key: Zobrist hash of the position
+		:return: slot holding the position, None if it isn't stored
+		"""
+		slot = key & self.mask
+		if self.marks[slot] < 0 or int(self.keys[slot]) != key:
+			return None
+		return slot
+
+	def taken_by_other(self, slot: int, key: int) -> bool:
+		"""
+		:return: True if slot holds a position other than key (store then applies its replacement rule)
+		"""
+		return self.marks[slot] >= 0 and int(self.keys[slot]) != key
+
+class TranspositionTable(ZobristTable):
+	"""
+	Fixed-size table of search results keyed by Zobrist hash (see ZobristTable). When two
+	positions share a slot, the replacement policy decides which one is kept:
+	- 'depth': keep the entry searched to the larger depth, unless it is from an earlier
+	  search (see new_search), so that expensive results survive.
+	- 'always': the newest entry always wins.
+	"""
+	NAME = 'transposition table'
+	EXACT = 0  # value is the exact score of the position
+	LOWER = 1  # value is a lower bound (search failed high)
+	UPPER = 2  # value is an upper bound (search failed low)
+
+	def __init__(self, size: int = 2**20, policy: str = 'depth', megabytes: Optional[float] = None):
+		"""
+		:param size: number of entries, rounded down to a power of two
+		:param policy: replacement policy, 'depth' or 'always'
+		:param megabytes: if given, use the largest size that fits into this much memory instead
+		"""
+		if policy not in ('depth', 'always'):
+			raise ValueError(f"unknown replacement policy {policy!r}")
+		if megabytes is not None:
+			size = int(megabytes * 2**20 // self.entry_bytes())
+		self.policy = policy
+		self.generation = 0
+		super().__init__(size)
+
+	def allocate(self, size: int) -> np.ndarray:
+		self.values = np.zeros(size, dtype=np.float64)
+		self.depths = np.full(size, -1, dtype=np.int16)  # -1 marks an empty slot
+		self.flags = np.zeros(size, dtype=np.int8)
+		self.moves = np.full(size, -1, dtype=np.int8)
+		self.ages = np.zeros(size, dtype=np.uint8)
+		return self.depths
+
+	@staticmethod
+	def entry_bytes() -> int:
+		"""
+		:return: memory used per entry (key, value, depth, flag, move and age)
+		"""
+		return 8 + 8 + 2 + 1 + 1 + 1
+
+	@property
+	def nbytes(self) -> int:
+		return self.size * self.entry_bytes()
+
+	def clear(self):
+		"""
+		Empties the table
+		"""
+		super().clear()
+		self.generation = 0
+
+	def new_search(self):
+		"""
+		Marks all entries as coming from an earlier search, so that 'depth' replacement can
+		overwrite them even if they were searched deeper.
+		"""
+		self.generation = (self.generation + 1) % 256
+
+	def lookup(self, key: int) -> Optional[TTEntry]:
+		"""
+		:param key: Zobrist hash of the position
+		:return: stored entry for the position, None if there is none
+		"""
+		slot = self.find(key)
+		if slot is None:
+			return None
+		return TTEntry(int(self.depths[slot]), float(self.values[slot]), int(self.flags[slot]), int(self.moves[slot]))
+
+	def store(self, key: int, depth: int, value: float, flag: int = EXACT, move: int = -1) -> bool:
+		"""
+		Stores a search result unless the replacement policy keeps the entry already in its slot
+		:param key: Zobrist hash of the position
+		:param depth: depth the position was searched to
+		:param value: score (or bound, see flag) of the position
+		:param flag: EXACT, LOWER or UPPER
+		:param move: best move found in the position (-1 if none)
+		:return: True if the entry was stored
+		"""
+		slot = key & self.mask
+		if self.policy == 'depth' and self.taken_by_other(slot, key) and self.depths[slot] > depth \
+				and self.ages[slot] == self.generation:
+			return False
+		self.keys[slot] = key
+		self.values[slot] = value
+		self.depths[slot] = depth
+		self.flags[slot] = flag
+		self.moves[slot] = move
+		self.ages[slot] = self.generation
+		return True
+
+class NodeTable(ZobristTable):
+	"""
+	Fixed-size table from the Zobrist hash of a position to its expanded node in an MCTS tree
+	(see ZobristTable). When two positions share a slot, the one whose node has more visits is kept.
+	"""
+	NAME = 'node table'
+
+	def __init__(self, size: int = 2**16):
+		"""
+		:param size: number of entries, rounded down to a power of two
+		"""
+		super().__init__(size)
+
+	def allocate(self, size: int) -> np.ndarray:
+		self.nodes = np.full(size, -1, dtype=np.int32)  # -1 marks an empty slot
+		return self.nodes
+
+	@property
+	def nbytes(self) -> int:
+		return self.keys.nbytes + self.nodes.nbytes
+
+	def lookup(self, key: int) -> Optional[int]:
+		"""
+		:param key: Zobrist hash of the position
+		:return: node of the position, None if there is none
+		"""
+		slot = self.find(key)
+		return None if slot is None else int(self.nodes[slot])
+
+	def store(self, key: int, node: int, visits: np.ndarray) -> bool:
+		"""
+		Stores the node of a position unless its slot holds another position with more visits
+		:param key: Zobrist hash of the position
+		:param node: node of the position
+		:param visits: visits of the nodes of the tree
+		:return: True if the entry was stored
+		"""
+		slot = key & self.mask
+		if self.taken_by_other(slot, key) and visits[self.nodes[slot]] > visits[node]:
+			return False
+		self.keys[slot] = key
+		self.nodes[slot] = node
+		return True
+
+class BitBoard:
+	"""
+	Bitboard representation of a board: one bit mask per player plus the column heights.
+	Position (row, col) is stored in bit col * (rows + 1) + row of the mask of the player
+	owning the piece. The extra bit on top of every column is never set, so shifting a
+	mask cannot carry a line over from one column into the next.
+	"""
+	def __init__(self, rows: int = 6, columns: int = 7):
+		self.rows = rows
+		self.columns = columns
+		self.height = rows + 1  # bits per column including the empty guard bit
+		self.masks = [0, 0]  # masks[player - 1] holds the pieces of player
+		self.heights = [0] * columns  # number of pieces in each column
+
+	def copy(self) -> 'BitBoard':
+		"""
+		Returns an independent copy of the bitboard
+		"""
+		other = BitBoard(self.rows, self.columns)
+		other.masks = list(self.masks)
+		other.heights = list(self.heights)
+		return other
+
+def board_to_bitboard(board: np.ndarray) -> BitBoard:
+	"""
+	Converts an ndarray board (as returned by initialize_game_state) into a BitBoard
+	:param board: current state of board
+	:return: bitboard holding the same pieces
+	"""
+	rows, columns = board.shape
+	bitboard = BitBoard(rows, columns)
+	for player in (PLAYER1, PLAYER2):
+		bitboard.masks[player - 1] = bitboard_mask(board, player)
+	bitboard.heights = [int(h) for h in np.count_nonzero(board != NO_PLAYER, axis=0)]
+	return bitboard
+
+def bitboard_to_board(bitboard: BitBoard) -> np.ndarray:
+	"""
+	Converts a BitBoard back into an ndarray board of dtype BoardPiece
+	:param bitboard: bitboard to convert
+	:return: ndarray board holding the same pieces
+	"""
+	board = np.zeros((bitboard.rows, bitboard.columns), dtype=BoardPiece)
+	for player in (PLAYER1, PLAYER2):
+		mask = bitboard.masks[player - 1]
+		for col in range(bitboard.columns):
+			for row in range(bitboard.heights[col]):
+				if mask >> (col * bitboard.height + row) & 1:
+					board[row, col] = player
+	return board
+
+def apply_player_action_bitboard(bitboard: BitBoard, action: PlayerAction, player: BoardPiece) -> BitBoard:
+	"""
+	Bitboard version of apply_player_action: drops a piece of player into column action.
+	The bitboard is modified in place and returned. Like apply_player_action, a move into a
+	full column changes nothing (the guard bit on top of the column must stay empty).
+	"""
+	action = int(action)
+	if bitboard.heights[action] == bitboard.rows:
+		return bitboard
+	bitboard.masks[player - 1] |= 1 << (action * bitboard.height + bitboard.heights[action])
+	bitboard.heights[action] += 1
+	return bitboard
+
+def connected_four_bitboard(
+	bitboard: BitBoard, player: BoardPiece, _last_action: Optional[PlayerAction] = None
+) -> bool:
+	"""
+	Bitboard version of connected_four (see _mask_connected)
+	"""
+	return _mask_connected(bitboard.masks[player - 1], bitboard.height)
+
+def connected_four_bitmask(
+	board: np.ndarray, player: BoardPiece, last_action: Optional[PlayerAction] = None
+) -> bool:
+	"""
+	connected_four for an ndarray board using the bitboard check: the pieces of player are
+	turned into a bit mask (see bitboard_mask) which is then checked by shifting and masking.
+	"""
+	if last_action is not None:
+		return connected_four_local(board, player, last_action)
+	return _mask_connected(bitboard_mask(board, player), board.shape[0] + 1)
+
+def bitboard_mask(board: np.ndarray, player: BoardPiece) -> int:
+	"""
+	Returns the bit mask (in the layout of BitBoard) of the pieces of player on an ndarray board
+	"""
+	return int(np.bitwise_or.reduce(_bitboard_weights(board.shape)[board == player]))
+
+@lru_cache(maxsize=None)
+def _bitboard_weights(shape: Tuple[int, int]) -> np.ndarray:
+	"""
+	Bit of every cell in the BitBoard layout, uint64 if the board fits into 64 bits
+	"""
+	rows, columns = shape
+	dtype = np.uint64 if columns * (rows + 1) <= 64 else object
+	weights = np.array([[1 << (col * (rows + 1) + row) for col in range(columns)] for row in range(rows)], dtype=dtype)
+	weights.flags.writeable = False
+	return weights
+
+def _mask_connected(mask: int, height: int) -> bool:
+	"""
+	Shift-and-mask check for CONNECT_N set bits in a line. Shifting the mask by the bit distance
+	of one step in a direction and and-ing it with itself CONNECT_N - 1 times leaves a bit set only
+	where CONNECT_N pieces are lined up in that direction.
+	"""
+	# vertical, horizontal, diagonal (down-right) and diagonal (up-right)
+	for shift in (1, height, height - 1, height + 1):
+		line = mask
+		for i in range(1, CONNECT_N):
+			line &= mask >> (i * shift)
+		if line:
+			return True
+	return False
+
+def check_board_full_bitboard(bitboard: BitBoard) -> bool:
+	"""
+	Bitboard version of check_board_full
+	:return: True if every column is filled up, False otherwise
+	"""
+	return bitboard.masks[0] | bitboard.masks[1] == _bitboard_full_mask(bitboard.rows, bitboard.columns)
+
+def check_open_columns_bitboard(bitboard: BitBoard) -> list:
+	"""
+	Bitboard version of check_open_columns: a column is open if its top cell isn't occupied
+	:return: list of open columns
+	"""
+	occupied = bitboard.masks[0] | bitboard.masks[1]
+	top = 1 << (bitboard.rows - 1)
+	return [col for col in range(bitboard.columns) if not occupied & (top << (col * bitboard.height))]
+
+def _bitboard_full_mask(rows: int, columns: int) -> int:
+	"""
+	Mask with every playable cell set (i.e. all bits except the guard bits)
+	"""
+	column = (1 << rows) - 1
+	return sum(column << (col * (rows + 1)) for col in range(columns))
+
+
+#compiled kernels live in agents.kernels, which is only imported on first use (numba is slow to import)
+_KERNELS = ('connected_four_iter', 'connected_four_local_iter', 'random_playout', 'random_playout_record',
+			'random_playouts', 'random_playouts_batch')
+
+def __getattr__(name: str):
+	if name in _KERNELS:
+		return getattr(import_module('agents.kernels'), name)
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+#registry of win-check backends: name -> function returning the implementation, so that
+#the modules a backend needs are only imported once it is selected
+WIN_CHECK_BACKENDS = {
+	'python': lambda: connected_four,
+	'numba': lambda: import_module('agents.kernels').compiled('connected_four_iter'),
+	'convolve': lambda: connected_four_convolve,
+	'bitboard': lambda: connected_four_bitmask,
+}
+DEFAULT_WIN_CHECK_BACKEND = 'bitboard'
+WIN_CHECK_ENV = 'CONNECT4_WIN_CHECK'  # environment variable overriding the default backend ('auto' calibrates)
+
+_win_check_backend = None
+_win_check = None
+
+def set_win_check_backend(name: str) -> str:
+	"""
+	Selects the implementation used by win_check (and so by check_end_state)
+	:param name: key of WIN_CHECK_BACKENDS, or 'auto' to pick the fastest one (see calibrate_win_check)
+	:return: name of the selected backend
+	"""
+	global _win_check_backend, _win_check
+	if name == 'auto':
+		return calibrate_win_check()
+	if name not in WIN_CHECK_BACKENDS:
+		raise ValueError(f"unknown win check backend {name!r}, choose from {sorted(WIN_CHECK_BACKENDS)} or 'auto'")
+	_win_check = WIN_CHECK_BACKENDS[name]()
+	_win_check_backend = name
+	return name
+
+def get_win_check_backend() -> str:
+	"""
+	:return: name of the backend used by win_check
+	"""
+	if _win_check_backend is None:
+		set_win_check_backend(os.environ.get(WIN_CHECK_ENV, DEFAULT_WIN_CHECK_BACKEND))
+	return _win_check_backend
+
+def calibrate_win_check(backends: Optional[list] = None, number: int = 200, last_action_share: float = 0.9) -> str:
+	"""
+	Times every backend on a few positions and selects the fastest one for win_check. Backends
+	that fail to load or to run (e.g. a missing optional dependency) are skipped.
+	:param backends: names of the backends to try, all registered ones by default
+	:param number: calls per backend and position
+	:param last_action_share: share of the calls that pass the last action (the agents' searches
+							  do, so they dominate) against full board scans
+	:return: name of the selected backend
+	"""
+	board = initialize_game_state()
+	positions = [(board.copy(), None)]
+	for i, action in enumerate((3, 3, 4, 2, 2, 5, 1, 3, 4, 4, 6, 0, 5, 2, 1, 1)):
+		apply_player_action(board, action, PLAYER1 if i % 2 == 0 else PLAYER2)
+		positions.append((board.copy(), action))
+
+	timings = {}
+	for name in backends or WIN_CHECK_BACKENDS:
+		try:
+			check = WIN_CHECK_BACKENDS[name]()
+			check(board, PLAYER1)  # warm up, e.g. numba compilation or a lazy import
+			check(board, PLAYER1, 1)
+			full = sum(timeit(lambda: check(b, PLAYER1), number=number) for b, _ in positions)
+			local = sum(timeit(lambda: check(b, PLAYER1, a), number=number) for b, a in positions if a is not None)
+		except Exception:
+			continue
+		timings[name] = (1 - last_action_share) * full + last_action_share * local
+	if not timings:
+		raise RuntimeError(f"none of the win check backends {backends or sorted(WIN_CHECK_BACKENDS)} works")
+	return set_win_check_backend(min(timings, key=timings.get))
+
+def win_check(board: np.ndarray, player: BoardPiece, last_action: Optional[PlayerAction] = None) -> bool:
+	"""
+	connected_four through the selected backend (see set_win_check_backend). This is the one
+	place the agents and check_end_state check for wins, so every caller uses the same implementation.
+	"""
+	if _win_check is None:
+		get_win_check_backend()
+	return _win_check(board, player, last_action)
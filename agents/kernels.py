@@ -0,0 +1,202 @@
+"""
+numba-compiled kernels of the game logic. This module is only imported when a compiled
+function is first needed (see agents.common), so agents that never use numba don't pay for
+importing and compiling it.
+
+The kernels are cached on disk (cache=True), so only the very first process compiles them.
+Optionally, they can also be compiled ahead of time into the extension module
+agents._kernels_aot with `python -m agents.build_kernels`; compiled() then hands out the
+ahead-of-time versions to python callers. Call warm_up() before the clock starts to make
+sure nothing is compiled during a move.
+
+The jitted kernels release the GIL (nogil=True), so python threads can run them in
+parallel; the ahead-of-time versions don't.
+"""
+import numpy as np
+from importlib import import_module
+from typing import Optional, Callable
+from numba import njit
+
+from agents.common import BoardPiece, PlayerAction, NO_PLAYER, PLAYER1, PLAYER2, CONNECT_N
+from agents.common import connected_four_local, initialize_game_state, make_rng_state
+
+#compiled version of connected_four_local, shares the source of the pure python function
+connected_four_local_iter = njit(cache=True, nogil=True)(connected_four_local)
+
+@njit(cache=True, nogil=True)
+def connected_four_iter(
+	board: np.ndarray, player: BoardPiece, last_action: Optional[PlayerAction] = None
+) -> bool:
+	if last_action is not None:
+		return connected_four_local_iter(board, player, last_action)
+	return connected_four_full_iter(board, player)
+
+@njit(cache=True, nogil=True)
+def connected_four_full_iter(board: np.ndarray, player: BoardPiece) -> bool:
+	rows, cols = board.shape
+	rows_edge = rows - CONNECT_N + 1
+	cols_edge = cols - CONNECT_N + 1
+
+	for i in range(rows):
+		for j in range(cols_edge):
+			if np.all(board[i, j:j+CONNECT_N] == player):
+				return True
+
+	for i in range(rows_edge):
+		for j in range(cols):
+			if np.all(board[i:i+CONNECT_N, j] == player):
+				return True
+
+	for i in range(rows_edge):
+		for j in range(cols_edge):
+			block = board[i:i+CONNECT_N, j:j+CONNECT_N]
+			if np.all(np.diag(block) == player):
+				return True
+			if np.all(np.diag(block[::-1, :]) == player):
+				return True
+
+	return False
+
+@njit(cache=True, nogil=True)
+def _xorshift(rng_state: np.ndarray) -> np.uint64:
+	x = rng_state[0]
+	x ^= x << np.uint64(13)
+	x ^= x >> np.uint64(7)
+	x ^= x << np.uint64(17)
+	rng_state[0] = x
+	return x
+
+@njit(cache=True, nogil=True)
+def random_playout(board: np.ndarray, player: BoardPiece, rng_state: np.ndarray) -> BoardPiece:
+	"""
+	Plays uniformly random moves from board until the game ends. The board isn't modified.
+	:param board: position to start from (nobody may have won yet)
+	:param player: player to move first
+	:param rng_state: state from make_rng_state
+	:return: winning player, NO_PLAYER for a draw
+	"""
+	return _random_playout(board, player, rng_state, np.empty(0, dtype=np.int8))
+
+@njit(cache=True, nogil=True)
+def random_playout_record(board: np.ndarray, player: BoardPiece, rng_state: np.ndarray, moves: np.ndarray) -> BoardPiece:
+	"""
+	random_playout that also records the game, e.g. for all-moves-as-first statistics
+	:param moves: int8 ndarray of length rows * columns, gets the cells played (row * columns + column) in
+				  order, -1 after the last one
+	:return: winning player, NO_PLAYER for a draw
+	"""
+	moves[:] = -1
+	return _random_playout(board, player, rng_state, moves)
+
+@njit(cache=True, nogil=True)
+def _random_playout(board: np.ndarray, player: BoardPiece, rng_state: np.ndarray, moves: np.ndarray) -> BoardPiece:
+	board = board.copy()
+	rows, cols = board.shape
+	record = moves.shape[0] > 0
+	heights = np.zeros(cols, dtype=np.int64)
+	for col in range(cols):
+		for row in range(rows):
+			if board[row, col] != NO_PLAYER:
+				heights[col] = row + 1
+
+	open_cols = np.empty(cols, dtype=np.int64)
+	num_moves = 0
+	while True:
+		num_open = 0
+		for col in range(cols):
+			if heights[col] < rows:
+				open_cols[num_open] = col
+				num_open += 1
+		if num_open == 0:
+			return NO_PLAYER
+		col = open_cols[int(_xorshift(rng_state) % np.uint64(num_open))]
+		board[heights[col], col] = player
+		if record:
+			moves[num_moves] = heights[col] * cols + col
+			num_moves += 1
+		heights[col] += 1
+		if connected_four_local_iter(board, player, col):
+			return player
+		player = PLAYER1 if player == PLAYER2 else PLAYER2
+
+@njit(cache=True, nogil=True)
+def random_playouts(board: np.ndarray, player: BoardPiece, num_playouts: int, rng_state: np.ndarray) -> np.ndarray:
+	"""
+	Runs num_playouts random_playouts from the same position
+	:return: ndarray of the winner of every playout (NO_PLAYER for draws)
+	"""
+	winners = np.empty(num_playouts, dtype=BoardPiece)
+	for i in range(num_playouts):
+		winners[i] = random_playout(board, player, rng_state)
+	return winners
+
+@njit(cache=True, nogil=True)
+def random_playouts_batch(boards: np.ndarray, players: np.ndarray, rng_state: np.ndarray) -> np.ndarray:
+	"""
+	Runs one random_playout from every board of a stack, e.g. the leaves of a batch of MCTS selections
+	:param boards: (n, rows, columns) stack of positions (nobody may have won yet)
+	:param players: player to move first on each board
+	:return: ndarray of the winner of every playout (NO_PLAYER for draws)
+	"""
+	winners = np.empty(boards.shape[0], dtype=BoardPiece)
+	for i in range(boards.shape[0]):
+		winners[i] = random_playout(boards[i], players[i], rng_state)
+	return winners
+
+AOT_MODULE = 'agents._kernels_aot'
+#kernels exported by the ahead-of-time compiled module and their signatures (see agents.build_kernels)
+AOT_SIGNATURES = {
+	'connected_four_full_iter': 'b1(i1[:,:], i1)',
+	'connected_four_local_iter': 'b1(i1[:,:], i1, i8)',
+	'random_playout': 'i1(i1[:,:], i1, u8[:])',
+	'random_playout_record': 'i1(i1[:,:], i1, u8[:], i1[:])',
+	'random_playouts': 'i1[:](i1[:,:], i1, i8, u8[:])',
+	'random_playouts_batch': 'i1[:](i1[:,:,:], i1[:], u8[:])',
+}
+
+try:
+	_aot = import_module(AOT_MODULE)
+except ImportError:
+	_aot = None
+
+def compiled(name: str) -> Callable:
+	"""
+	Returns the version of a kernel to call from python: the ahead-of-time compiled one if
+	agents._kernels_aot has been built, the jitted one otherwise.
+	:param name: name of the kernel in this module
+	"""
+	if _aot is None:
+		return globals()[name]
+	if name == 'connected_four_iter':
+		return _connected_four_iter_aot
+	if name in AOT_SIGNATURES:
+		return getattr(_aot, name)
+	return globals()[name]
+
+def _connected_four_iter_aot(
+	board: np.ndarray, player: BoardPiece, last_action: Optional[PlayerAction] = None
+) -> bool:
+	if last_action is not None:
+		return _aot.connected_four_local_iter(board, player, last_action)
+	return _aot.connected_four_full_iter(board, player)
+
+def warm_up() -> bool:
+	"""
+	Calls every kernel once, so that they are compiled (or loaded from the disk cache) now
+	instead of during the first move. Meant for the init hook of agents.
+	:return: True if the ahead-of-time compiled module is used
+	"""
+	board = initialize_game_state()
+	rng_state = make_rng_state(0)
+	connected_four = compiled('connected_four_iter')
+	#full scan and local check, with the column as python int and as PlayerAction
+	connected_four(board, PLAYER1)
+	connected_four(board, PLAYER1, 0)
+	connected_four(board, PLAYER1, PlayerAction(0))
+	compiled('random_playout')(board, PLAYER1, rng_state)
+	compiled('random_playout_record')(board, PLAYER1, rng_state, np.empty(board.size, dtype=np.int8))
+	random_playout_record(board, PLAYER1, rng_state, np.empty(board.size, dtype=np.int8))
+	compiled('random_playouts')(board, PLAYER1, 1, rng_state)
+	compiled('random_playouts_batch')(board[np.newaxis], np.array([PLAYER1], dtype=BoardPiece), rng_state)
+	random_playouts_batch(board[np.newaxis], np.array([PLAYER1], dtype=BoardPiece), rng_state)
+	return _aot is not None
@@ -3,7 +3,7 @@ from typing import Optional, Callable
 from agents.common import PlayerAction, BoardPiece, SavedState, GenMove
 #from agents.agent_random import generate_move
 #from agents.agent_minimax import generate_move
-from agents.agent_mcts.agent_mcts import generate_move
+from agents.agent_mcts.agent_mcts import generate_move, init, Budget, json_log, MCTSSavedState
 
 def user_move(board: np.ndarray, _player: BoardPiece, saved_state: Optional[SavedState]):
     action = PlayerAction(-1)
@@ -55,7 +55,7 @@ def human_vs_agent(
                 )
                 print(f"Move time: {time.time() - t0:.3f}s")
                 apply_player_action(board, action, player)
-                end_state = check_end_state(board, player)
+                end_state = check_end_state(board, player, action)
                 if end_state != GameState.STILL_PLAYING:
                     print(pretty_print_board(board))
                     if end_state == GameState.IS_DRAW:
@@ -67,6 +67,43 @@ def human_vs_agent(
                     playing = False
                     break
 
+        # agents that ponder would go on searching the finished game
+        for state in saved_state.values():
+            if isinstance(state, MCTSSavedState):
+                state.stop_pondering()
+
 if __name__ == "__main__":
+    import argparse
+    from functools import partial
+    from agents.common import WIN_CHECK_BACKENDS, WIN_CHECK_ENV, DEFAULT_WIN_CHECK_BACKEND, set_win_check_backend
+
+    parser = argparse.ArgumentParser(description="Play Connect 4 against an agent")
+    parser.add_argument("--win-check", choices=sorted(WIN_CHECK_BACKENDS) + ["auto"],
+                        help=f"win check backend, 'auto' picks the fastest "
+                             f"(default: ${WIN_CHECK_ENV} or {DEFAULT_WIN_CHECK_BACKEND})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of parallel MCTS searches (processes) merged at the root")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="number of threads searching the same MCTS tree")
+    parser.add_argument("--seconds", type=float, default=Budget().seconds,
+                        help="MCTS thinking time per move")
+    parser.add_argument("--iterations", type=int, help="MCTS iterations per move (default: no limit)")
+    parser.add_argument("--ponder", action="store_true", help="let MCTS keep searching while you think")
+    parser.add_argument("--batch-size", type=int, default=1, help="MCTS leaves simulated together in one kernel call "
+                                                                     "(slower with the built-in rollouts, for batch evaluators)")
+    parser.add_argument("--rave", action="store_true", help="blend all-moves-as-first statistics into MCTS (RAVE)")
+    parser.add_argument("--transpositions", type=int, default=0,
+                        help="size of the table that merges transpositions in the MCTS tree (default: off)")
+    parser.add_argument("--stats-log", help="append the statistics of every MCTS search to this file (JSON lines)")
+    cli_args = parser.parse_args()
+    if cli_args.win_check:
+        print(f"Win check backend: {set_win_check_backend(cli_args.win_check)}")
+
     #human_vs_agent(user_move)
-    human_vs_agent(generate_move)
\ No newline at end of file
+    budget = Budget(cli_args.seconds, cli_args.iterations)
+    # settings are passed by keyword, so they don't depend on the order of generate_move's parameters
+    agent_move = partial(generate_move, workers=cli_args.workers, threads=cli_args.threads, budget=budget,
+                         ponder=cli_args.ponder, batch_size=cli_args.batch_size, rave=cli_args.rave,
+                         transpositions=cli_args.transpositions,
+                         stats_hook=json_log(cli_args.stats_log) if cli_args.stats_log else None)
+    human_vs_agent(agent_move, init_1=init)
\ No newline at end of file
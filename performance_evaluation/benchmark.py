@@ -0,0 +1,254 @@
+"""
+Benchmark suite for the hot functions of the agents.
+
+Times every hot function in agents.common, the minimax heuristic, a fixed-depth minimax search,
+an iterative deepening search with transposition table and single MCTS iterations on a corpus
+of mid-game and late-game positions, with numba JIT on and off (each mode runs in its own
+interpreter, since numba reads NUMBA_DISABLE_JIT on import).
+Results are written as JSON so that runs on different commits can be compared:
+
+	python -m performance_evaluation.benchmark --output bench.json
+	python -m performance_evaluation.benchmark --compare bench.json --tolerance 0.25
+
+With --compare the exit code is 1 if any benchmark got slower than the baseline by more than
+the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import timeit
+from typing import Callable, Dict, List, Tuple
+
+CORPUS_SEED = 2020
+#(name, first ply, last ply) of the positions in the corpus
+PHASES = (("midgame", 10, 20), ("lategame", 24, 34))
+
+
+def make_corpus(seed: int = CORPUS_SEED, per_phase: int = 8) -> Dict[str, List[Tuple]]:
+	"""
+	Plays seeded random games and keeps positions that are still being played
+	:param seed: seed of the random games, so that every run uses the same positions
+	:param per_phase: number of positions per game phase
+	:return: dict phase -> list of (board, player to move, last action)
+	"""
+	import numpy as np
+	from agents.common import PLAYER1, PLAYER2, GameState
+	from agents.common import initialize_game_state, apply_player_action, check_end_state, check_open_columns
+
+	rng = np.random.default_rng(seed)
+	corpus = {}
+	for phase, first_ply, last_ply in PHASES:
+		positions = []
+		while len(positions) < per_phase:
+			board = initialize_game_state()
+			player, plies = PLAYER1, int(rng.integers(first_ply, last_ply + 1))
+			for _ in range(plies):
+				action = rng.choice(check_open_columns(board))
+				apply_player_action(board, action, player)
+				if check_end_state(board, player, action) != GameState.STILL_PLAYING:
+					break
+				player = PLAYER2 if player == PLAYER1 else PLAYER1
+			else:
+				positions.append((board, player, action))
+		corpus[phase] = positions
+	return corpus
+
+
+def benchmarks(corpus: Dict[str, List[Tuple]], minimax_depth: int, mcts_iterations: int) -> Dict[str, Callable]:
+	"""
+	Builds the benchmarks. Every benchmark is a function without arguments that runs the
+	benchmarked call once on every position of the corpus.
+	"""
+	import math
+	import numpy as np
+	from agents import common
+	from agents.common import Board
+	from agents.agent_minimax.agent_minimax import heuristic, heuristic_batch, minimax, iterative_deepening
+	from agents.agent_mcts.agent_mcts import MCTS, Tree, Budget
+
+	positions = [position for phase in corpus.values() for position in phase]
+	boards = [board for board, _, _ in positions]
+	stack = np.stack(boards)
+	players = np.array([player for _, player, _ in positions], dtype=common.BoardPiece)
+	bitboards = [common.board_to_bitboard(board) for board in boards]
+	wrapped = [Board(board) for board in boards]
+	rng_state = common.make_rng_state(CORPUS_SEED)
+	opponents = [common.PLAYER2 if player == common.PLAYER1 else common.PLAYER1 for _, player, _ in positions]
+
+	def over_positions(call: Callable) -> Callable:
+		return lambda: [call(board, player, action, opponent) for (board, player, action), opponent
+						in zip(positions, opponents)]
+
+	def mcts_iterations_run():
+		for (board, player, _), opponent in zip(positions, opponents):
+			tree = Tree(board, opponent)
+			game = Board(board)
+			mcts = MCTS(player)
+			tree.visits[Tree.ROOT] += 1
+			for _ in range(mcts_iterations):
+				path = mcts.selection(tree, game)
+				mcts.backpropagation(tree, path, mcts.simulation(tree, path[-1], game))
+				for _ in path[1:]:
+					game.undo()
+
+	def mcts_batch_iterations_run():
+		for (board, player, _), opponent in zip(positions, opponents):
+			mcts = MCTS(player, budget=Budget(seconds=None, iterations=mcts_iterations), batch_size=8)
+			mcts.search(Tree(board, opponent))
+
+	def board_play_undo():
+		for board, (_, player, _) in zip(wrapped, positions):
+			for column in board.legal_moves():
+				board.play(column, player)
+				board.undo()
+
+	return {
+		"apply_player_action": over_positions(
+			lambda board, player, action, opponent: common.apply_player_action(board.copy(), action, player)),
+		"connected_four": over_positions(
+			lambda board, player, action, opponent: common.connected_four(board, opponent)),
+		"connected_four_last_action": over_positions(
+			lambda board, player, action, opponent: common.connected_four(board, opponent, action)),
+		"connected_four_iter": over_positions(
+			lambda board, player, action, opponent: common.connected_four_iter(board, opponent)),
+		"connected_four_convolve": over_positions(
+			lambda board, player, action, opponent: common.connected_four_convolve(board, opponent)),
+		"connected_four_bitboard": lambda: [common.connected_four_bitboard(bitboard, opponent)
+											for bitboard, opponent in zip(bitboards, opponents)],
+		"connected_four_bitmask": over_positions(
+			lambda board, player, action, opponent: common.connected_four_bitmask(board, opponent)),
+		"connected_four_batch": lambda: common.connected_four_batch(stack, players),
+		"check_end_state": over_positions(
+			lambda board, player, action, opponent: common.check_end_state(board, opponent)),
+		"check_end_state_batch": lambda: common.check_end_state_batch(stack, players),
+		"check_board_full": over_positions(
+			lambda board, player, action, opponent: common.check_board_full(board)),
+		"check_open_columns": over_positions(
+			lambda board, player, action, opponent: common.check_open_columns(board)),
+		"board_to_bitboard": over_positions(
+			lambda board, player, action, opponent: common.board_to_bitboard(board)),
+		"board_play_undo": board_play_undo,
+		"random_playout": over_positions(
+			lambda board, player, action, opponent: common.random_playout(board, player, rng_state)),
+		"heuristic": over_positions(
+			lambda board, player, action, opponent: heuristic(board, player)),
+		"heuristic_batch": lambda: heuristic_batch(stack, common.PLAYER1),
+		f"minimax_depth_{minimax_depth}": over_positions(
+			lambda board, player, action, opponent: minimax(board, minimax_depth, -math.inf, math.inf, player, True)),
+		f"iterative_deepening_depth_{minimax_depth + 2}": over_positions(
+			lambda board, player, action, opponent: iterative_deepening(board, player, None, minimax_depth + 2)),
+		f"mcts_{mcts_iterations}_iterations": mcts_iterations_run,
+		f"mcts_{mcts_iterations}_iterations_batch_8": mcts_batch_iterations_run,
+	}
+
+
+def run_benchmarks(repeat: int, minimax_depth: int, mcts_iterations: int, only: List[str]) -> Dict[str, float]:
+	"""
+	Times the benchmarks in this interpreter
+	:return: dict benchmark name -> best time per position in microseconds
+	"""
+	import random
+	import numpy as np
+
+	corpus = make_corpus()
+	count = sum(len(phase) for phase in corpus.values())
+	results = {}
+	for name, bench in benchmarks(corpus, minimax_depth, mcts_iterations).items():
+		if only and not any(pattern in name for pattern in only):
+			continue
+		random.seed(CORPUS_SEED)
+		np.random.seed(CORPUS_SEED)
+		bench()  # warm up (numba compilation, caches)
+		#pick a number of calls per repeat that takes roughly 0.2 s
+		number, elapsed = 1, timeit.timeit(bench, number=1)
+		while elapsed * number < 0.2 and number < 10**4:
+			number *= 10
+		best = min(timeit.repeat(bench, number=number, repeat=repeat))
+		results[name] = best / number / count * 1e6
+	return results
+
+
+def run_mode(jit: bool, args: argparse.Namespace) -> Dict[str, float]:
+	"""
+	Runs the benchmarks in a fresh interpreter with numba JIT switched on or off
+	"""
+	env = dict(os.environ, NUMBA_DISABLE_JIT="0" if jit else "1")
+	command = [sys.executable, "-m", "performance_evaluation.benchmark", "--worker",
+			   "--repeat", str(args.repeat), "--minimax-depth", str(args.minimax_depth),
+			   "--mcts-iterations", str(args.mcts_iterations)] + sum((["--only", name] for name in args.only), [])
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	output = subprocess.run(command, env=env, cwd=root, check=True, stdout=subprocess.PIPE).stdout
+	return json.loads(output)
+
+
+def metadata() -> dict:
+	"""
+	Describes the commit and environment the benchmarks ran on
+	"""
+	import numba
+	import numpy as np
+	try:
+		commit = subprocess.run(["git", "rev-parse", "HEAD"], stdout=subprocess.PIPE,
+								stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+			"numba": numba.__version__, "machine": platform.machine(), "unit": "us per position"}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+	"""
+	:return: descriptions of all benchmarks that are slower than baseline by more than tolerance
+	"""
+	regressions = []
+	for mode, timings in results["results"].items():
+		for name, time in timings.items():
+			reference = baseline.get("results", {}).get(mode, {}).get(name)
+			if reference and time > reference * (1 + tolerance):
+				regressions.append(f"{mode}/{name}: {time:.1f} us vs {reference:.1f} us (+{time / reference - 1:.0%})")
+	return regressions
+
+
+def main(argv: List[str] = None) -> int:
+	parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+	parser.add_argument("--jit", choices=("on", "off", "both"), default="both")
+	parser.add_argument("--repeat", type=int, default=5)
+	parser.add_argument("--minimax-depth", type=int, default=3)
+	parser.add_argument("--mcts-iterations", type=int, default=50)
+	parser.add_argument("--only", action="append", default=[], help="only run benchmarks whose name contains this")
+	parser.add_argument("--output", help="write the results to this JSON file")
+	parser.add_argument("--compare", help="JSON file of an earlier run to check for regressions against")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown vs --compare (0.25 = 25%%)")
+	parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+	args = parser.parse_args(argv)
+
+	if args.worker:
+		json.dump(run_benchmarks(args.repeat, args.minimax_depth, args.mcts_iterations, args.only), sys.stdout)
+		return 0
+
+	modes = {"on": (True,), "off": (False,), "both": (True, False)}[args.jit]
+	results = {"meta": metadata(), "results": {}}
+	for jit in modes:
+		mode = "jit" if jit else "nojit"
+		results["results"][mode] = run_mode(jit, args)
+		for name, time in results["results"][mode].items():
+			print(f"{mode:>6} {name:<32} {time:10.1f} us per position")
+
+	if args.output:
+		with open(args.output, "w") as file:
+			json.dump(results, file, indent=2)
+
+	if args.compare:
+		with open(args.compare) as file:
+			regressions = compare(results, json.load(file), args.tolerance)
+		for regression in regressions:
+			print(f"REGRESSION {regression}")
+		return 1 if regressions else 0
+	return 0
+
+
+if __name__ == "__main__":
+	sys.exit(main())
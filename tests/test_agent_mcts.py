@@ -1,93 +1,113 @@
-from agents.agent_mcts.agent_mcts import Node, MCTS, generate_move
+from agents.agent_mcts.agent_mcts import Tree, MCTS, Budget, MCTSSavedState, SearchStats, generate_move, \
+	root_search, shutdown_pool, json_log, PONDER_BUDGET
 from agents.common import *
-from time import time
+from time import time, sleep
 from copy import deepcopy
+import threading
+import json
 
-# CHECK NODE FUNCTIONS
+# CHECK TREE FUNCTIONS
 
-def test_node():
+def test_tree():
 
-	# check implementation of root Node
+	# check implementation of the root node
 	board = initialize_game_state()
-	root_node = Node(board, parent=None, col=-1, player=PLAYER1)
-
-	assert root_node.unexpanded_moves == check_open_columns(board)
-	assert np.array_equal(board, root_node.board)
-	assert root_node.parent == None
-	assert root_node.value == 0
-	assert root_node.num_visits == 0
-	assert root_node.is_root == True
-	assert root_node.player == PLAYER1
-	assert root_node.column_move == -1
-
-	# check non-root Node
-	non_root_node = Node(board, parent=root_node, col=-1, player=PLAYER2)
-
-	assert non_root_node.unexpanded_moves == check_open_columns(board)
-	assert np.array_equal(board, non_root_node.board)
-	assert non_root_node.parent == root_node
-	assert non_root_node.value == 0
-	assert non_root_node.num_visits == 0
-	assert non_root_node.is_root == False
-	assert non_root_node.player == PLAYER2
-	assert non_root_node.column_move == -1
-
-def test_ucb_value():
+	tree = Tree(board, PLAYER1)
 
-	board = initialize_game_state()
-	root_node = Node(board, parent=None, col=-1, player=PLAYER1)
-
-	assert root_node.num_visits == 0
-	# return 0 for no visit
-	assert root_node.ucb_value() == np.inf
-
-	# return correct value for number of visits
-	root_node.num_visits = 1
-	arb_node = Node(board, parent=root_node, col=-1, player=PLAYER1)
-	for i in np.arange(1,5,1):
-		arb_node.num_visits = i
-		correct_res = (arb_node.value / arb_node.num_visits) + \
-		              (np.sqrt(2) * (np.sqrt(np.abs(np.log(arb_node.parent.num_visits) / arb_node.num_visits))))
-		# returns nan when parent node has 0 visits
-		assert Node.ucb_value(arb_node) == correct_res
+	assert tree.size == 1
+	assert np.array_equal(board, tree.board)
+	assert tree.parent[Tree.ROOT] == -1
+	assert tree.values[Tree.ROOT] == 0
+	assert tree.visits[Tree.ROOT] == 0
+	assert tree.player[Tree.ROOT] == PLAYER1
+	assert tree.move[Tree.ROOT] == -1
+	assert len(tree.children(Tree.ROOT)) == 0
+
+	# nodes only take a few bytes each
+	assert tree.nbytes < 30 * tree.capacity
 
 def test_expansion():
-	move = 3
 	board = initialize_game_state()
-	root_node = Node(board, parent=None, col=-1, player=PLAYER1)
-	#root_node.expansion(move, board, PLAYER1)
-
-	# children are stored in a list format, expansion just returns the node (not in a list format)
-	assert root_node.children == [root_node.expansion(move, board, PLAYER1)] # returns and appends child correctly
-	assert root_node.unexpanded_moves == [0,1,2,4,5,6] # removed correct move
+	tree = Tree(board, PLAYER1)
+
+	# all children are allocated in one block, moved by the other player
+	first = tree.expand(Tree.ROOT, (0, 1, 2, 4))
+	assert first == 1 and tree.size == 5
+	assert list(tree.children(Tree.ROOT)) == [1, 2, 3, 4]
+	assert list(tree.move[1:5]) == [0, 1, 2, 4]
+	assert (tree.player[1:5] == PLAYER2).all()
+	assert (tree.parent[1:5] == Tree.ROOT).all()
+	assert tree.child(Tree.ROOT, 4) == 4 and tree.child(Tree.ROOT, 3) is None
+
+	# boards are rebuilt along the path
+	tree.expand(4, (3,))
+	assert tree.path(5) == [0, 4, 5]
+	expected = apply_player_action(apply_player_action(board.copy(), 4, PLAYER2), 3, PLAYER1)
+	assert np.array_equal(tree.node_board(5), expected)
+
+	# arrays grow when the capacity is used up
+	small = Tree(board, PLAYER1, capacity=2)
+	small.expand(Tree.ROOT, tuple(range(7)))
+	assert small.capacity >= 8 and list(small.move[1:8]) == list(range(7))
+	assert small.first_child[1] == -1
+
+def test_subtree():
+	board = initialize_game_state()
+	tree = Tree(board, PLAYER1)
+	tree.expand(Tree.ROOT, (0, 1, 2))
+	tree.expand(2, (0, 1))
+	tree.expand(5, (4,))
+	tree.visits[5] = 3
+	tree.values[6] = 0.5
+
+	sub = tree.subtree(2)
+	assert sub.size == 4
+	assert np.array_equal(sub.board, tree.node_board(2))
+	assert sub.player[Tree.ROOT] == PLAYER2
+	assert list(sub.move[sub.children(Tree.ROOT)]) == [0, 1]
+	grandchild = sub.child(sub.child(Tree.ROOT, 1), 4)
+	assert sub.values[grandchild] == 0.5 and sub.visits[sub.parent[grandchild]] == 3
+	assert np.array_equal(sub.node_board(grandchild), tree.node_board(6))
 
 # CHECK MCTS FUNCTIONS
 
 # test MCTS objects
 player1 = MCTS(PLAYER1)
 player2 = MCTS(PLAYER2)
-# test board and NODE object
+# test board
 board = initialize_game_state()
-root_node = Node(board, parent=None, col=-1, player=PLAYER1)
 
 def test_mcts():
 	assert player1.player == PLAYER1
 	assert np.round(player2.start_time,0) == np.round(time(),0) # 3rd decimal place may differ
 	assert player2.player == PLAYER2
 
+def test_ucb_values():
+	tree = Tree(board, PLAYER2)
+	tree.expand(Tree.ROOT, (0, 1))
+	tree.visits[Tree.ROOT] = 5
+	tree.visits[1] = 4
+	tree.values[1] = 3
+
+	ucb = player1.ucb_values(tree, Tree.ROOT)
+	assert ucb[0] == 3 / 4 + np.sqrt(2) * np.sqrt(np.log(5) / 4)
+	# return inf for no visit
+	assert ucb[1] == np.inf
+
 def test_backpropagation():
-	# return nothing for root_node
-	assert player1.backpropagation(root_node, 0) == None
+	tree = Tree(board, PLAYER2)
+	tree.expand(Tree.ROOT, (3,))
+	tree.expand(1, (4,))
+	tree.expand(2, (2,))
 
-	# create some leaf nodes and check if they're backpropagated correctly
-	first_node = Node(board, parent=root_node, col=3, player=PLAYER1)
-	second_node = Node(board, parent=first_node, col=4, player=PLAYER1)
-	leaf_node = Node(board, parent=second_node, col=2, player=PLAYER1)
+	# call backpropagate for a win of the leaf's player (PLAYER1)
+	player1.backpropagation(tree, [0, 1, 2, 3], 1)
+	assert list(tree.visits[:4]) == [1, 1, 1, 1]
+	assert list(tree.values[:4]) == [-1, 1, -1, 1]
 
-	#call backpropagate
-	player1.backpropagation(leaf_node, 1)
-	assert first_node.num_visits == 1
-	assert first_node.value == 1
+	# draws count for both players
+	player1.backpropagation(tree, [0, 1], 0.2)
+	assert tree.visits[1] == 2 and tree.values[1] == 1.2
 
 def test_check_time():
 	player1 = MCTS(PLAYER1)
@@ -98,30 +118,22 @@ def test_check_time():
 	assert player1.check_time(5) == False
 
 def test_highest_ucb():
-	board = initialize_game_state()
-	current_node = Node(board, parent=None, col=-1, player=PLAYER1)
+	tree = Tree(board, PLAYER2)
 
 	# check if  children are 0 returns None
-	assert len(current_node.children) == 0
-	assert player1.highest_ucb(current_node) == None
+	assert player1.highest_ucb(tree, Tree.ROOT) == None
 
 	# add children, define max ucb val, check if its returned
-	child_one = Node(board, parent=current_node, col=0, player=PLAYER1)
-	child_two = Node(board, parent=current_node, col=1, player=PLAYER1)
-	child_three = Node(board, parent=current_node, col=2, player=PLAYER1)
-	child_one.num_visits = 1
-	child_one.value = 9
-	child_two.num_visits = 15
-	child_two.value = 3
-	child_three.num_visits = 2
-	child_three.value = 20
-
-	current_node.children.append(child_one)
-	current_node.children.append(child_two)
-	current_node.children.append(child_three)
-
-	assert len(current_node.children) == 3
-	assert player1.highest_ucb(current_node) == child_one
+	tree.expand(Tree.ROOT, (0, 1, 2))
+	tree.visits[Tree.ROOT] = 18
+	tree.visits[1:4] = 1, 15, 2
+	tree.values[1:4] = 9, 3, 10
+
+	assert player1.highest_ucb(tree, Tree.ROOT) == 1
+
+	# unvisited children come first
+	tree.visits[2] = 0
+	assert player1.highest_ucb(tree, Tree.ROOT) == 2
 
 def test_result():
 
@@ -142,18 +154,88 @@ def test_result():
 def test_select_random_child():
 	mcts = MCTS(PLAYER1)
 
-	root_node = Node(board, parent=None, col=-1, player=PLAYER1)
-	child_one = Node(board, parent=root_node, col=0, player=PLAYER1)
-	child_two = Node(board, parent=root_node, col=1, player=PLAYER1)
-	child_three = Node(board, parent=root_node, col=2, player=PLAYER1)
-	root_node.children.append(child_one)
-	root_node.children.append(child_two)
-	root_node.children.append(child_three)
-
-	random_node = mcts.select_random_child(root_node.children)
+	children = [1, 2, 3]
+	random_child = mcts.select_random_child(children)
 
 	# check that returns (one) child
-	assert random_node == child_one or random_node == child_two or random_node == child_three
+	assert random_child in children
+
+def test_selection():
+	tree = Tree(board, PLAYER2)
+	game = Board(board)
+	mcts = MCTS(PLAYER1, seed=0)
+
+	# the root is expanded and a new leaf is played on the board
+	path = mcts.selection(tree, game)
+	assert path[0] == Tree.ROOT and len(path) == 2
+	assert tree.size == 8 and tree.player[path[1]] == PLAYER1
+	assert np.array_equal(game.state, tree.node_board(path[1]))
+
+	# a winning move solves the node it leads to and its parent, the path ends at the solved node
+	win_board = board.copy()
+	win_board[0, 0:3] = PLAYER1
+	tree = Tree(win_board, PLAYER2)
+	game = Board(win_board)
+	path = mcts.selection(tree, game)
+	assert path == [Tree.ROOT] and np.array_equal(game.state, win_board)
+	assert tree.proven[tree.child(Tree.ROOT, 3)] == Tree.WIN and tree.proven[Tree.ROOT] == Tree.LOSS
+
+def test_simulation():
+	# seeded rollouts are reproducible
+	tree = Tree(board, PLAYER2)
+	tree.expand(Tree.ROOT, (3,))
+	child_board = Board(tree.node_board(1))
+	results = [MCTS(PLAYER1, seed=5).simulation(tree, 1, child_board) for _ in range(2)]
+	assert results[0] == results[1]
+	assert results[0] in (1, -1, 0.2)
+
+	# solved nodes aren't simulated
+	tree.proven[1] = Tree.WIN
+	assert MCTS(PLAYER1).simulation(tree, 1, child_board) == 1
+	tree.proven[1] = Tree.LOSS
+	assert MCTS(PLAYER1).simulation(tree, 1, child_board) == -1
+	tree.proven[1] = Tree.DRAW
+	assert MCTS(PLAYER1).simulation(tree, 1, child_board) == 0.2
+
+def test_prove():
+	tree = Tree(board, PLAYER2)
+	mcts = MCTS(PLAYER1)
+	tree.expand(Tree.ROOT, (0, 1))
+	tree.expand(1, (0, 1))
+	tree.expand(2, (0, 1))
+
+	# a won reply loses the move before it
+	tree.proven[3] = Tree.WIN
+	mcts.prove(tree, [0, 1, 3])
+	assert tree.proven[1] == Tree.LOSS and tree.proven[Tree.ROOT] == Tree.UNKNOWN
+
+	# a move whose replies are all solved and one is drawn is a draw
+	tree.proven[5] = Tree.LOSS
+	mcts.prove(tree, [0, 2, 5])
+	assert tree.proven[2] == Tree.UNKNOWN
+	tree.proven[6] = Tree.DRAW
+	mcts.prove(tree, [0, 2, 6])
+	assert tree.proven[2] == Tree.DRAW and tree.proven[Tree.ROOT] == Tree.DRAW
+
+	# selection skips solved children and the best child isn't a proven loss
+	tree.visits[:3] = 10, 5, 5
+	tree.values[1:3] = 5, 0
+	tree.proven[2] = Tree.UNKNOWN
+	tree.proven[Tree.ROOT] = Tree.UNKNOWN
+	assert mcts.highest_ucb(tree, Tree.ROOT) == 2
+	assert mcts.best_child(tree) == 2
+
+def test_solver():
+	# PLAYER1 wins in two: a double threat on the bottom row
+	two_board = board.copy()
+	two_board[0, 2:4] = PLAYER1
+	two_board[1, 2:4] = PLAYER2
+	tree = Tree(two_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=5))
+	assert mcts.monte_carlo_tree_search(tree) in (1, 4)
+	# the search stopped as soon as the win was proven
+	assert tree.proven[Tree.ROOT] == Tree.LOSS
+	assert time() - mcts.start_time < 4
 
 def test_monte_carlo_tree_search():
 
@@ -166,21 +248,332 @@ def test_monte_carlo_tree_search():
 	win_board = apply_player_action(win_board, 1, PLAYER1)
 	win_board = apply_player_action(win_board, 2, PLAYER1)
 
-	# create root Node object
-	root = Node(board_copy=deepcopy(win_board), parent=None, col=-1, player=PLAYER1)
+	# create search tree (PLAYER2 moved last)
+	tree = Tree(win_board, PLAYER2)
 	# create MCTS object for player
-	mcts1 = MCTS(PLAYER1)  # to start the time
+	mcts1 = MCTS(PLAYER1, budget=Budget(seconds=1))  # to start the time
 	# call monte carlo tree search starting from root node
-	action = mcts1.monte_carlo_tree_search(root)
+	action = mcts1.monte_carlo_tree_search(tree)
 
 	assert action == 3 # mcts should choose an immediate win for PLAYER1
+	# the board of the root is left unchanged
+	assert np.array_equal(tree.board, win_board)
 
-	mcts2 = MCTS(PLAYER2)
-	action = mcts2.monte_carlo_tree_search(root)
+	mcts2 = MCTS(PLAYER2, budget=Budget(seconds=1))
+	action = mcts2.monte_carlo_tree_search(Tree(win_board, PLAYER1))
 
 	assert action == 3 # mcts should choose an immediate block for PLAYER2
 
+def test_budget():
+	start_board = apply_player_action(board.copy(), 3, PLAYER2)
+
+	# iteration budget
+	tree = Tree(start_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=100))
+	assert mcts.monte_carlo_tree_search(tree) in range(7)
+	assert mcts.iterations == 100 and tree.visits[Tree.ROOT] == 101
+
+	# node budget
+	tree = Tree(start_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, nodes=50))
+	mcts.monte_carlo_tree_search(tree)
+	assert 50 <= tree.size < 50 + 7
+
+	# the clock is only looked at every check_every iterations
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=0, check_every=10))
+	mcts.next_clock_check = 10
+	mcts.monte_carlo_tree_search(Tree(start_board, PLAYER2))
+	assert mcts.iterations == 10
+
+	# a cancelled search still returns a move, immediate wins are found without any iterations
+	win_board = board.copy()
+	win_board[0, 0:3] = PLAYER1
+	mcts = MCTS(PLAYER1)
+	mcts.stop()
+	assert mcts.monte_carlo_tree_search(Tree(win_board, PLAYER2)) == 3
+	assert mcts.iterations == 0
+	assert mcts.monte_carlo_tree_search(Tree(start_board, PLAYER2)) in range(7)
+
+	# generate_move can be stopped early from another thread
+	cancel = threading.Event()
+	threading.Timer(0.2, cancel.set).start()
+	start = time()
+	action, saved_state = generate_move(start_board, PLAYER1, None, budget=Budget(seconds=30), cancel=cancel)
+	assert time() - start < 5
+	assert action in range(7) and saved_state.tree.visits[Tree.ROOT] > 1
+
+def test_root_parallel():
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+
+	# a worker's search returns the statistics of the root's children
+	moves, visits, values, proven = root_search(block_board, PLAYER2, PLAYER1, 0, time(), budget=Budget(seconds=0.2))
+	assert list(moves) == list(range(7)) and visits.sum() > 0
+	# every move but the block is proven lost
+	assert list(proven == Tree.LOSS) == [True] * 3 + [False] + [True] * 3
+
+	# merged statistics are added to the children of the root
+	tree = Tree(block_board, PLAYER2)
+	mcts = MCTS(PLAYER1)
+	mcts.merge_root(tree, moves, visits, values, proven)
+	mcts.merge_root(tree, moves, visits, values, proven)
+	assert list(tree.visits[tree.children(Tree.ROOT)]) == list(2 * visits)
+	assert tree.visits[Tree.ROOT] == 2 * visits.sum()
+	assert list(tree.proven[tree.children(Tree.ROOT)]) == list(proven)
+
+	# searches in worker processes are merged before the move is chosen
+	mcts = MCTS(PLAYER1, workers=2, budget=Budget(seconds=0.5))
+	tree = Tree(block_board, PLAYER2)
+	assert mcts.monte_carlo_tree_search(tree) == 3
+	assert tree.visits[Tree.ROOT] == 1 + tree.visits[tree.children(Tree.ROOT)].sum()
+
+	# a cancellation stops the workers too, so the next move has them all
+	start_board = apply_player_action(board.copy(), 3, PLAYER2)
+	cancel = threading.Event()
+	threading.Timer(0.3, cancel.set).start()
+	start = time()
+	action, _ = generate_move(start_board, PLAYER1, None, workers=2, budget=Budget(seconds=10), cancel=cancel)
+	assert action in range(7) and time() - start < 3
+	start = time()
+	generate_move(start_board, PLAYER1, None, workers=2, budget=Budget(seconds=0.5))
+	assert time() - start < 2
+	shutdown_pool()
+
+def test_tree_parallel():
+	tree = Tree(board, PLAYER2)
+	game = Board(board)
+	mcts = MCTS(PLAYER1, threads=2, budget=Budget(seconds=0.5))
+
+	# virtual loss: a selected path counts as visited and lost until it is backpropagated
+	path = mcts.selection(tree, game, virtual_loss=1.0)
+	assert tree.visits[path[1]] == 1 and tree.values[path[1]] == -1
+	# the next selection takes another child
+	other = mcts.selection(tree, Board(board), virtual_loss=1.0)
+	assert other[1] != path[1]
+	mcts.backpropagation(tree, path, 1, virtual_loss=1.0)
+	assert tree.visits[path[1]] == 1 and tree.values[path[1]] == 1
+	assert tree.visits[Tree.ROOT] == 2
+
+	# threads searching the same tree find the block
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+	tree = Tree(block_board, PLAYER2)
+	assert mcts.monte_carlo_tree_search(tree) == 3
+	assert tree.visits[Tree.ROOT] == 1 + tree.visits[tree.children(Tree.ROOT)].sum()
+
+def test_batch():
+	# solved nodes are scored from their proof, the others are simulated together
+	tree = Tree(board, PLAYER2)
+	mcts = MCTS(PLAYER1, seed=2, batch_size=4)
+	tree.expand(Tree.ROOT, (0, 1, 2))
+	tree.proven[2] = Tree.LOSS
+	boards = np.stack([tree.node_board(node) for node in (1, 2, 3)])
+	scores = mcts.simulation_batch(tree, [1, 2, 3], boards)
+	assert scores[1] == -1 and set(scores) <= {1, -1, 0.2}
+	expected = MCTS(PLAYER1, seed=2).batch_playout(boards[[0, 2]], np.array([PLAYER2, PLAYER2], dtype=BoardPiece),
+												   make_rng_state(2))
+	assert [scores[0], scores[2]] == [mcts.score(tree, 1, expected[0]), mcts.score(tree, 3, expected[1])]
+
+	# batches of selections are backpropagated together
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+	tree = Tree(block_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=400), batch_size=8)
+	assert mcts.monte_carlo_tree_search(tree) == 3
+	assert mcts.iterations == 400
+	assert tree.visits[Tree.ROOT] == 401 == 1 + tree.visits[tree.children(Tree.ROOT)].sum()
+	# the last batch is cut to the budget
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=203), batch_size=8)
+	mcts.monte_carlo_tree_search(Tree(block_board, PLAYER2))
+	assert mcts.iterations == 203
+	tree = Tree(block_board, PLAYER2)
+	MCTS(PLAYER1, budget=Budget(seconds=None, nodes=100), batch_size=8).monte_carlo_tree_search(tree)
+	assert 100 <= tree.size < 100 + 7
+
+def test_rave():
+	tree = Tree(board, PLAYER2)
+	nbytes = tree.nbytes
+	tree.enable_rave()
+	assert tree.nbytes == nbytes + 8 * tree.capacity
+	mcts = MCTS(PLAYER1, rave=True)
+	tree.expand(Tree.ROOT, (0, 1, 2))
+	tree.expand(2, (0, 1, 2))
+
+	# PLAYER1 played 1 then PLAYER2 played 0, the rollout went on with PLAYER1 in 2 and PLAYER2 in 1 (cell 8)
+	moves = np.full(42, -1, dtype=np.int8)
+	moves[:2] = 2, 8
+	mcts.update_amaf(tree, [0, 2, 4], 1, moves, Board(tree.node_board(4)))
+	# root children (PLAYER1): cells 1 and 2, children of PLAYER1's move (PLAYER2): cells 0 and 8
+	assert list(tree.amaf_visits[1:4]) == [0, 1, 1]
+	assert list(tree.amaf_values[1:4]) == [0, -1, -1]
+	assert list(tree.amaf_visits[4:7]) == [1, 1, 0]
+	assert list(tree.amaf_values[4:7]) == [1, 1, 0]
+
+	# amaf values weigh in while a child has few visits
+	tree.visits[:4] = 3, 1, 1, 1
+	tree.values[1:4] = 1, 1, 1
+	ucb = mcts.ucb_values(tree, Tree.ROOT)
+	assert ucb[0] > ucb[1] and ucb[1] == ucb[2]
+	assert MCTS(PLAYER1).ucb_values(tree, Tree.ROOT)[0] == ucb[0]
+
+	# subtrees keep the statistics, rollouts are recorded
+	sub = tree.subtree(2)
+	assert sub.rave and list(sub.amaf_visits[1:4]) == [1, 1, 0]
+
+	# a column is a different cell later on
+	moves[:2] = 9, 2
+	mcts.update_amaf(tree, [0, 2, 4], -1, moves, Board(tree.node_board(4)))
+	assert list(tree.amaf_visits[1:4]) == [0, 2, 1]
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+	tree = Tree(block_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=300), rave=True)
+	assert mcts.monte_carlo_tree_search(tree) == 3
+	assert tree.amaf_visits[tree.children(Tree.ROOT)].sum() > 300
+	try:
+		MCTS(PLAYER1, rave=True, batch_size=4)
+		assert False
+	except ValueError:
+		pass
+
+def test_transpositions():
+	# 0, 1, 2 and 2, 1, 0 lead to the same position, which shares one block of children
+	empty = initialize_game_state()
+	tree = Tree(empty, PLAYER2)
+	tree.enable_transpositions(1024)
+	mcts = MCTS(PLAYER1)
+	game = Board(empty)
+	for moves in ((0, 1, 2), (2, 1, 0)):
+		node = Tree.ROOT
+		for move in moves:
+			if tree.num_children[node] == 0:
+				mcts.expansion(tree, node, game)
+			node = tree.child(node, move)
+			game.play(move, tree.player[node])
+		mcts.expansion(tree, node, game)
+		for _ in moves:
+			game.undo()
+	a = tree.child(tree.child(tree.child(Tree.ROOT, 0), 1), 2)
+	b = tree.child(tree.child(tree.child(Tree.ROOT, 2), 1), 0)
+	assert a != b and tree.first_child[a] == tree.first_child[b]
+	assert np.array_equal(tree.node_board(a), tree.node_board(b))
+	# subtrees copy a shared block once
+	sub = tree.subtree(Tree.ROOT)
+	assert sub.size == tree.size and sub.table is not None and len(sub.table) == 0
+	# a proof found through 0, 1, 2 reaches the other parent when selection passes it
+	tree.proven[tree.first_child[a]] = Tree.WIN
+	mcts.prove(tree, [Tree.ROOT, tree.child(Tree.ROOT, 0), tree.child(tree.child(Tree.ROOT, 0), 1), a])
+	assert tree.proven[a] == Tree.LOSS and tree.proven[b] == Tree.UNKNOWN
+	tree.visits[:tree.size] = 1
+	tree.values[:tree.size] = 0
+	tree.values[[tree.child(Tree.ROOT, 2), tree.child(tree.child(Tree.ROOT, 2), 1), b]] = 1
+	path = mcts.selection(tree, Board(empty))
+	assert path[-1] == b and tree.proven[b] == Tree.LOSS
+
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+	tree = Tree(block_board, PLAYER2)
+	mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=500), transpositions=4096)
+	assert mcts.monte_carlo_tree_search(tree) == 3
+	expanded = tree.num_children[:tree.size] > 0
+	assert len(np.unique(tree.first_child[:tree.size][expanded])) < expanded.sum()
+
+def test_stats(tmp_path):
+	block_board = board.copy()
+	block_board[0, 0:3] = PLAYER2
+	for batch_size in (1, 4):
+		tree = Tree(block_board, PLAYER2)
+		mcts = MCTS(PLAYER1, budget=Budget(seconds=None, iterations=200), batch_size=batch_size, stats=True)
+		assert mcts.monte_carlo_tree_search(tree) == 3
+		stats = mcts.stats
+		assert stats.iterations == mcts.iterations >= 200
+		assert stats.nodes == tree.size and stats.root_moves == list(range(7))
+		assert sum(stats.root_visits) == tree.visits[tree.children(Tree.ROOT)].sum()
+		assert 1 <= stats.average_depth <= stats.max_depth
+		assert stats.selection > 0 and stats.simulation > 0 and stats.backpropagation > 0
+		assert stats.selection + stats.simulation + stats.backpropagation <= stats.seconds
+		assert stats.iterations_per_second > 0
+	assert MCTS(PLAYER1).stats is None
+
+	# generate_move keeps the stats and hands them to the hook
+	log = tmp_path / 'stats.jsonl'
+	seen = []
+	hook = json_log(str(log))
+	for _ in range(2):
+		_, saved_state = generate_move(block_board, PLAYER1, None, budget=Budget(seconds=None, iterations=100),
+									   stats_hook=lambda stats: seen.append(stats) or hook(stats))
+	assert isinstance(saved_state.stats, SearchStats) and saved_state.stats is seen[-1]
+	lines = log.read_text().splitlines()
+	assert len(lines) == 2 and json.loads(lines[0])['iterations'] >= 100
+	_, saved_state = generate_move(block_board, PLAYER1, None, budget=Budget(seconds=None, iterations=100))
+	assert saved_state.stats is None
 
 def test_generate_move():
 	# test that generate move plays in center on empty board
-	assert generate_move(board, PLAYER1, False) == (3, False)
\ No newline at end of file
+	assert generate_move(board, PLAYER1, False) == (3, False)
+
+def test_tree_reuse():
+	# grow a tree for PLAYER1 after PLAYER2 opened in column 0
+	start_board = apply_player_action(deepcopy(board), 0, PLAYER2)
+	tree = Tree(start_board, PLAYER2)
+	game = Board(start_board)
+	mcts = MCTS(PLAYER1, seed=0)
+	tree.visits[Tree.ROOT] += 1
+	for _ in range(500):
+		path = mcts.selection(tree, game)
+		mcts.backpropagation(tree, path, mcts.simulation(tree, path[-1], game))
+		for _ in path[1:]:
+			game.undo()
+
+	# players alternate below the root and boards follow the moves
+	our_node = max(tree.children(Tree.ROOT), key=lambda child: tree.visits[child])
+	reply_node = max(tree.children(our_node), key=lambda child: tree.visits[child])
+	assert tree.player[our_node] == PLAYER1 and tree.player[reply_node] == PLAYER2
+	assert np.array_equal(tree.node_board(reply_node), apply_player_action(
+		apply_player_action(deepcopy(start_board), tree.move[our_node], PLAYER1), tree.move[reply_node], PLAYER2))
+
+	# the opponent's reply becomes the new root
+	saved_state = MCTSSavedState(tree, our_node)
+	new_tree = saved_state.find_root(tree.node_board(reply_node))
+	assert new_tree.visits[Tree.ROOT] == tree.visits[reply_node]
+	assert new_tree.size == 1 + sum(1 for node in range(tree.size) if reply_node in tree.path(node)[:-1])
+	assert saved_state.find_root(start_board) is None
+
+	# generate_move hands the subtree over between calls
+	action, saved_state = generate_move(start_board, PLAYER1, None, budget=Budget(seconds=1))
+	assert isinstance(saved_state, MCTSSavedState)
+	assert saved_state.tree.move[saved_state.node] == action
+	reply_node = max(saved_state.tree.children(saved_state.node), key=lambda child: saved_state.tree.visits[child])
+	visits = saved_state.tree.visits[reply_node]
+	reply_board = saved_state.tree.node_board(reply_node)
+	_, next_saved_state = generate_move(reply_board, PLAYER1, saved_state, budget=Budget(seconds=1))
+	assert np.array_equal(next_saved_state.tree.board, reply_board)
+	assert next_saved_state.tree.visits[Tree.ROOT] > visits
+
+def test_pondering():
+	start_board = apply_player_action(deepcopy(board), 0, PLAYER2)
+	action, saved_state = generate_move(start_board, PLAYER1, None, budget=Budget(seconds=0.2), ponder=True)
+	assert saved_state.ponder_thread.is_alive()
+
+	# the search goes on in the background after the move was returned
+	visits = saved_state.tree.visits[Tree.ROOT]
+	sleep(0.3)
+	assert saved_state.tree.visits[Tree.ROOT] > visits
+	assert np.array_equal(saved_state.tree.board, apply_player_action(start_board.copy(), action, PLAYER1))
+
+	# the next call stops it and continues from the subtree of the actual reply
+	reply = max(saved_state.tree.children(Tree.ROOT), key=lambda child: saved_state.tree.visits[child])
+	reply_board = saved_state.tree.node_board(reply)
+	ponder_thread = saved_state.ponder_thread
+	_, next_saved_state = generate_move(reply_board, PLAYER1, saved_state, budget=Budget(seconds=0.2))
+	assert not ponder_thread.is_alive() and saved_state.ponder is None
+	assert next_saved_state.ponder is None
+	assert np.array_equal(next_saved_state.tree.board, reply_board)
+
+	# pondering that isn't resumed ends with its time limit
+	assert PONDER_BUDGET.seconds is not None
+	next_saved_state.start_pondering(PLAYER2, budget=Budget(seconds=0.2))
+	ponder_thread = next_saved_state.ponder_thread
+	assert ponder_thread.daemon and ponder_thread.is_alive()
+	ponder_thread.join(2)
+	assert not ponder_thread.is_alive()
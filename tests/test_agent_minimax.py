@@ -1,7 +1,7 @@
 import numpy as np
 import math
 from agents.common import BoardPiece, NO_PLAYER, PLAYER1, PLAYER2, GameState
-from agents.common import initialize_game_state, pretty_print_board, string_to_board, connected_four, apply_player_action, check_board_full, check_end_state
+from agents.common import initialize_game_state, pretty_print_board, string_to_board, connected_four, apply_player_action, check_board_full, check_end_state, check_open_columns
 from agents.agent_minimax.agent_minimax import *
 
 still_playing_board = "|==============|\n" \
@@ -22,6 +22,14 @@ def test_generate_move():
 	#first move should be in column 3 and saved state not modified
 	assert ret == (3,board)
 
+	#there is no search without depth or moves
+	for args, kwargs in (((board, PLAYER1, None), {'max_depth': 0}), ((np.full_like(board, PLAYER1), PLAYER2, None), {})):
+		try:
+			generate_move(*args, **kwargs)
+			assert False
+		except ValueError:
+			pass
+
 def test_center_column_score():
 
 	filled_board = string_to_board(still_playing_board)
@@ -134,3 +142,146 @@ def test_minimax():
 
 	#first move should be in center column 3
 	assert minimax(board, 4, -math.inf, math.inf, PLAYER1, True) == (3,7)
+
+	#the opponent moves first and minimizes the score of PLAYER2
+	assert minimax(board, 4, -math.inf, math.inf, PLAYER2, False) == (2,7)
+	assert minimax(board, 3, -math.inf, math.inf, PLAYER2, False) == (3,-10)
+
+def test_negamax():
+
+	from agents.common import TranspositionTable, Board
+
+	#the transposition table doesn't change the scores of a fixed depth search
+	board = string_to_board(still_playing_board)
+	board[5, :] = NO_PLAYER
+	board[4, 4] = NO_PLAYER
+	for player in (PLAYER1, PLAYER2):
+		for depth in (1, 2, 3, 4):
+			search = Negamax(player, TranspositionTable(2**12))
+			score = search.negamax(Board(board), depth, -math.inf, math.inf, player)
+			assert (search.root_move, score) == minimax(board, depth, -math.inf, math.inf, player, True)
+
+	#wins that come sooner score higher
+	board = initialize_game_state()
+	board[0, 0:3] = PLAYER1
+	board[1, 0:2] = PLAYER2
+	search = Negamax(PLAYER1)
+	assert search.negamax(Board(board), 3, -math.inf, math.inf, PLAYER1) == WIN_SCORE - 1
+	assert search.root_move == 3
+
+def test_iterative_deepening():
+
+	from time import time
+
+	board = initialize_game_state()
+	board[0, 0:3] = PLAYER1
+	board[1, 0:2] = PLAYER2
+
+	#the opponent has to block the win
+	move, score, depth = iterative_deepening(board, PLAYER2, None, max_depth=4)
+	assert move == 3 and depth == 4 and score > -WIN_SCORE + 100
+
+	#a win ends the deepening
+	assert iterative_deepening(board, PLAYER1, None) == (3, WIN_SCORE - 1, 1)
+
+	#the deepest completed search is returned when the time is up
+	board = string_to_board(still_playing_board)
+	board[2:, :] = NO_PLAYER
+	start = time()
+	move, score, depth = iterative_deepening(board, PLAYER1, 0.2)
+	assert time() - start < 0.5
+	assert 1 <= depth < 24 and move in check_open_columns(board)
+
+	#the deepest search has the score of a fixed depth search (ties may be broken by another move)
+	assert iterative_deepening(board, PLAYER1, None, max_depth=3)[1] == minimax(board, 3, -math.inf, math.inf, PLAYER1, True)[1]
+
+def test_move_ordering():
+
+	from agents.common import TranspositionTable, Board
+
+	ordering = MoveOrdering()
+	moves = (0, 1, 2, 3, 4, 5, 6)
+	#center first, then the table move, killers and history in front of it
+	assert ordering.order(moves, PLAYER1, 0) == (3, 2, 4, 1, 5, 0, 6)
+	ordering.cutoff(6, PLAYER1, 2, 3)
+	assert ordering.order(moves, PLAYER1, 0)[0] == 6 #history
+	assert ordering.order(moves, PLAYER2, 0)[0] == 3
+	ordering.cutoff(0, PLAYER2, 2, 1)
+	assert ordering.order(moves, PLAYER2, 2)[:2] == (0, 6) #killers of ply 2, latest first
+	assert ordering.order(moves, PLAYER2, 2, table_move=5)[:3] == (5, 0, 6)
+	killers_only = MoveOrdering(history=False)
+	killers_only.cutoff(4, PLAYER1, 1, 2)
+	killers_only.cutoff(6, PLAYER1, 1, 2)
+	assert killers_only.order(moves, PLAYER1, 1)[:3] == (6, 4, 3) #the latest killer even before a more central one
+	assert MoveOrdering(center=False, killers=0, history=False).order(moves, PLAYER1, 2) == moves
+
+	#ordering changes the nodes searched, not the scores
+	board = string_to_board(still_playing_board)
+	board[2:, :] = NO_PLAYER
+	plain = Negamax(PLAYER1, TranspositionTable(2**12), ordering=MoveOrdering(center=False, killers=0, history=False))
+	ordered = Negamax(PLAYER1, TranspositionTable(2**12), ordering=MoveOrdering())
+	assert plain.iterative_deepening(Board(board), None, 5)[1:] == ordered.iterative_deepening(Board(board), None, 5)[1:]
+	assert sum(ordered.nodes_per_depth.values()) == ordered.nodes < plain.nodes
+	assert sorted(ordered.nodes_per_depth) == [1, 2, 3, 4, 5]
+	assert 0 < ordered.cutoff_rate < 1 and ordered.first_move_cutoff_rate > plain.first_move_cutoff_rate
+
+def test_incremental_heuristic():
+
+	from agents.common import Board
+
+	#the lookup tables give the scores of the scalar functions
+	for player in (PLAYER1, PLAYER2):
+		assert window_score_table(player)[3, 0] == 100 and window_score_table(player)[0, 3] == -70 and window_score_table(player)[3, 1] == 0
+		assert window_score_table(player)[4, 0] == 10000 and window_score_table(player)[0, 4] == 0
+	board = string_to_board(still_playing_board)
+	assert cell_weights(board.shape, PLAYER2)[board == PLAYER2].sum() == center_column_score(board, PLAYER2) + even_odd_row_scores(board, PLAYER2)
+
+	#the score follows random moves and undos
+	rng = np.random.default_rng(0)
+	for player in (PLAYER1, PLAYER2):
+		board = Board()
+		evaluator = IncrementalHeuristic(board.state, player)
+		played = []
+		for _ in range(200):
+			if played and (rng.random() < 0.4 or board.is_full()):
+				row, column, piece = played.pop()
+				board.undo()
+				evaluator.undo(row, column, piece)
+			else:
+				column = int(rng.choice(board.legal_moves()))
+				piece = PLAYER1 if board.move_count % 2 == 0 else PLAYER2
+				played.append((board.play(column, piece), column, piece))
+				evaluator.play(*played[-1])
+			assert evaluator.score == heuristic(board.state, player)
+		assert IncrementalHeuristic(board.state, player).score == evaluator.score
+
+	#searches score the leaves the same way with and without it
+	board = string_to_board(still_playing_board)
+	board[2:, :] = NO_PLAYER
+	for player in (PLAYER1, PLAYER2):
+		incremental, scalar = Negamax(player), Negamax(player, incremental=False)
+		score = incremental.negamax(Board(board), 4, -math.inf, math.inf, player)
+		assert score == scalar.negamax(Board(board), 4, -math.inf, math.inf, player)
+		assert incremental.root_move == scalar.root_move
+		assert incremental.nodes == scalar.nodes
+
+def test_heuristic_batch():
+
+	#equal to the scalar heuristic on random positions, including won and full boards
+	rng = np.random.default_rng(1)
+	boards = []
+	for game in range(30):
+		board = initialize_game_state()
+		player = PLAYER1
+		for _ in range(rng.integers(0, 43)):
+			open_cols = check_open_columns(board)
+			if not open_cols:
+				break
+			apply_player_action(board, rng.choice(open_cols), player)
+			player = PLAYER2 if player == PLAYER1 else PLAYER1
+		boards.append(board)
+	boards.append(string_to_board(still_playing_board))
+	boards = np.stack(boards)
+	for player in (PLAYER1, PLAYER2):
+		assert list(heuristic_batch(boards, player)) == [heuristic(board, player) for board in boards]
+	assert heuristic_batch(boards[:0], PLAYER1).shape == (0,)
@@ -170,4 +170,355 @@ def test_check_open_columns():
 	open_cols = string_to_board(still_playing_board)
 	check_open_columns(open_cols)
 
-	assert list(check_open_columns(open_cols)) == [1,3,4]
\ No newline at end of file
+	assert list(check_open_columns(open_cols)) == [1,3,4]
+
+def random_game_boards(seed: int = 0, games: int = 20) -> list:
+	"""
+	Plays random games and returns (board, player, action) after every move until one ends
+	"""
+	from agents.common import check_open_columns
+	rng = np.random.default_rng(seed)
+	positions = []
+	for _ in range(games):
+		board = initialize_game_state()
+		player = PLAYER1
+		while True:
+			action = rng.choice(check_open_columns(board))
+			apply_player_action(board, action, player)
+			positions.append((board.copy(), player, action))
+			if check_end_state(board, player) != GameState.STILL_PLAYING:
+				break
+			player = PLAYER2 if player == PLAYER1 else PLAYER1
+	return positions
+
+def test_bitboard_conversion():
+	from agents.common import board_to_bitboard, bitboard_to_board
+
+	board = string_to_board(still_playing_board)
+	bitboard = board_to_bitboard(board)
+
+	assert bitboard.heights == [6, 5, 6, 5, 3, 6, 6]
+	assert np.array_equal(bitboard_to_board(bitboard), board)
+	assert bitboard_to_board(bitboard).dtype == BoardPiece
+
+	empty = board_to_bitboard(initialize_game_state())
+	assert empty.masks == [0, 0]
+	assert np.array_equal(bitboard_to_board(empty), initialize_game_state())
+
+def test_bitboard_functions():
+	from agents.common import board_to_bitboard, bitboard_to_board, apply_player_action_bitboard, \
+		connected_four_bitboard, check_board_full_bitboard, check_open_columns_bitboard, BitBoard
+
+	bitboard = BitBoard()
+	for board, player, action in random_game_boards():
+		apply_player_action_bitboard(bitboard, action, player)
+		assert np.array_equal(bitboard_to_board(bitboard), board)
+		for piece in (PLAYER1, PLAYER2):
+			assert connected_four_bitboard(bitboard, piece) == connected_four(board, piece)
+		assert check_open_columns_bitboard(bitboard) == check_open_columns(board)
+		assert check_board_full_bitboard(bitboard) == check_board_full(board)
+		if check_end_state(board, player) != GameState.STILL_PLAYING:
+			bitboard = BitBoard()
+
+	assert check_board_full_bitboard(board_to_bitboard(string_to_board(full_draw_board)))
+	assert not connected_four_bitboard(board_to_bitboard(string_to_board(full_draw_board)), PLAYER1)
+
+	#dropping a piece into a full column changes nothing, the guard bit stays empty
+	board = initialize_game_state()
+	board[0:3, 0] = PLAYER1
+	board[3:6, 0] = PLAYER2
+	bitboard = board_to_bitboard(board)
+	apply_player_action_bitboard(bitboard, 0, PLAYER2)
+	assert bitboard.heights[0] == 6 and np.array_equal(bitboard_to_board(bitboard), board)
+	assert not connected_four_bitboard(bitboard, PLAYER2)
+
+def test_connected_four_last_action():
+	from agents.common import connected_four_iter, connected_four_convolve, connected_four_local
+
+	for board, player, action in random_game_boards(seed=1):
+		for piece in (PLAYER1, PLAYER2):
+			full_scan = connected_four(board, piece)
+			assert connected_four_local(board, piece, action) == full_scan
+			assert connected_four(board, piece, action) == full_scan
+			assert connected_four_iter(board, piece, action) == full_scan
+			assert connected_four_convolve(board, piece, action) == full_scan
+		assert check_end_state(board, player, action) == check_end_state(board, player)
+
+	#piece in column 0 completes the bottom row
+	board = initialize_game_state()
+	board[0, 1:4] = PLAYER1
+	apply_player_action(board, 0, PLAYER1)
+
+	assert connected_four_local(board, PLAYER1, 0)
+	assert not connected_four_local(board, PLAYER2, 0)
+	assert not connected_four_local(board, PLAYER1, 5) #empty column
+
+def test_connected_four_batch():
+	from agents.common import connected_four_batch, check_end_state_batch
+
+	positions = random_game_boards(seed=2)
+	boards = np.stack([board for board, _, _ in positions])
+	players = np.array([player for _, player, _ in positions], dtype=BoardPiece)
+
+	won = connected_four_batch(boards, players)
+	assert won.shape == (len(positions),)
+	assert list(won) == [connected_four(board, player) for board, player, _ in positions]
+	assert list(connected_four_batch(boards, PLAYER2)) == [connected_four(board, PLAYER2) for board in boards]
+
+	states = check_end_state_batch(boards, players)
+	assert list(states) == [check_end_state(board, player).value for board, player, _ in positions]
+	assert check_end_state_batch(string_to_board(full_draw_board)[None], PLAYER1)[0] == GameState.IS_DRAW.value
+
+def test_line_windows():
+	from agents.common import line_windows, connected_four_batch, WINDOWS
+
+	assert WINDOWS.shape == (69, 4)
+	assert len({tuple(sorted(window)) for window in WINDOWS}) == 69
+	#horizontal, vertical, diagonal and anti-diagonal windows starting at the lower-left corner
+	assert [0, 1, 2, 3] in WINDOWS.tolist()
+	assert [0, 7, 14, 21] in WINDOWS.tolist()
+	assert [0, 8, 16, 24] in WINDOWS.tolist()
+	assert [3, 9, 15, 21] in WINDOWS.tolist()
+
+	assert line_windows((6, 7), 4) is WINDOWS
+	assert line_windows((4, 4), 4).shape == (10, 4)
+	assert line_windows((3, 3), 3).shape == (8, 3)
+
+	#non-standard board sizes work in the full-board win checks
+	board = np.zeros((5, 9), dtype=BoardPiece)
+	board[1, 5:9] = PLAYER2
+	assert connected_four(board, PLAYER2)
+	assert not connected_four(board, PLAYER1)
+	players = np.array([PLAYER1, PLAYER2], dtype=BoardPiece)
+	assert list(connected_four_batch(np.stack([board, board]), players)) == [False, True]
+
+def test_board():
+	from agents.common import Board
+
+	board = Board()
+	assert np.array_equal(board.state, initialize_game_state())
+	assert board.legal_moves() == (0, 1, 2, 3, 4, 5, 6)
+	assert board.last_move is None
+	assert board.move_count == 0
+
+	#playing and taking back moves matches apply_player_action on an ndarray
+	reference = initialize_game_state()
+	moves = [3, 3, 2, 4, 3, 3, 3, 3]
+	for i, move in enumerate(moves):
+		player = PLAYER1 if i % 2 == 0 else PLAYER2
+		assert board.play(move, player) == np.count_nonzero(reference[:, move])
+		apply_player_action(reference, move, player)
+		assert np.array_equal(board.state, reference)
+	assert board.heights == [0, 0, 1, 6, 1, 0, 0]
+	assert board.move_count == len(moves)
+	assert board.last_move == 3
+	assert board.legal_moves() == (0, 1, 2, 4, 5, 6)
+	assert not board.is_legal(3) and board.is_legal(4)
+
+	assert board.undo() == 3
+	assert board.legal_moves() == (0, 1, 2, 3, 4, 5, 6)
+	assert board.heights[3] == 5
+	while board.history:
+		board.undo()
+	assert np.array_equal(board.state, initialize_game_state())
+
+	#wraps existing boards without modifying them
+	ndarray_board = string_to_board(still_playing_board)
+	board = Board(ndarray_board)
+	assert list(board.legal_moves()) == check_open_columns(ndarray_board)
+	board.play(4, PLAYER1)
+	assert ndarray_board[3, 4] == NO_PLAYER
+	assert board.end_state(PLAYER1) == check_end_state(board.state, PLAYER1)
+
+	draw = Board(string_to_board(full_draw_board))
+	assert draw.is_full() and draw.legal_moves() == ()
+	assert draw.end_state(PLAYER1) == GameState.IS_DRAW
+
+	copied = board.copy()
+	copied.undo()
+	assert board.last_move == 4 and copied.last_move is None
+
+def test_zobrist_hash():
+	from agents.common import Board, zobrist_hash
+
+	assert zobrist_hash(initialize_game_state()) == 0
+	board = Board()
+	hashes = [board.hash]
+	for i, move in enumerate([3, 3, 2, 4, 5, 0, 3]):
+		board.play(move, PLAYER1 if i % 2 == 0 else PLAYER2)
+		assert board.hash == zobrist_hash(board.state)
+		hashes.append(board.hash)
+	assert len(set(hashes)) == len(hashes)
+	while board.history:
+		assert board.hash == hashes.pop()
+		board.undo()
+	assert board.hash == 0
+
+	#transpositions (same position, different move order) get the same hash
+	first, second = Board(), Board()
+	for move, player in ((2, PLAYER1), (4, PLAYER2), (3, PLAYER1)):
+		first.play(move, player)
+	for move, player in ((3, PLAYER1), (4, PLAYER2), (2, PLAYER1)):
+		second.play(move, player)
+	assert first.hash == second.hash
+	assert Board(first.state).hash == first.hash
+
+def test_transposition_table():
+	from agents.common import TranspositionTable
+
+	table = TranspositionTable(size=100)
+	assert table.size == 64 and len(table) == 0
+	assert table.lookup(12345) is None
+
+	assert table.store(12345, depth=3, value=1.5, flag=TranspositionTable.LOWER, move=2)
+	assert table.lookup(12345) == (3, 1.5, TranspositionTable.LOWER, 2)
+	assert len(table) == 1
+
+	#12345 + 64 maps to the same slot: depth-preferred keeps the deeper entry ...
+	assert not table.store(12345 + 64, depth=1, value=0.0)
+	assert table.lookup(12345 + 64) is None
+	assert table.store(12345 + 64, depth=5, value=-1.0)
+	assert table.lookup(12345) is None
+	assert table.lookup(12345 + 64).value == -1.0
+	# ... unless it is left over from an earlier search
+	table.new_search()
+	assert table.store(12345, depth=0, value=2.0)
+
+	always = TranspositionTable(size=64, policy='always')
+	always.store(7, depth=9, value=1.0)
+	assert always.store(7 + 64, depth=0, value=2.0)
+	assert always.lookup(7) is None
+
+	assert TranspositionTable(megabytes=1).nbytes <= 2**20
+	table.clear()
+	assert len(table) == 0
+	try:
+		TranspositionTable(size=0)
+		assert False
+	except ValueError:
+		pass
+
+def test_node_table():
+	from agents.common import NodeTable, ZobristTable
+
+	table = NodeTable(100)
+	assert table.size == 64 and len(table) == 0
+	visits = np.array([0, 5, 1])
+	assert table.store(3, 1, visits) and table.lookup(3) == 1
+	assert table.lookup(3 + 64) is None
+	#the slot keeps the node with more visits
+	assert not table.store(3 + 64, 2, visits)
+	visits[2] = 9
+	assert table.store(3 + 64, 2, visits) and table.lookup(3) is None and table.lookup(3 + 64) == 2
+	assert table.nbytes == 64 * 12
+	table.clear()
+	assert len(table) == 0
+	#the base class only has the slot logic
+	try:
+		ZobristTable(64)
+		assert False
+	except TypeError:
+		pass
+
+def test_random_playout():
+	from agents.common import make_rng_state, random_playout, random_playouts, random_playouts_batch, \
+		random_playout_record
+
+	board = initialize_game_state()
+	winners = random_playouts(board, PLAYER1, 200, make_rng_state(3))
+	assert set(winners) <= {NO_PLAYER, PLAYER1, PLAYER2}
+	assert np.count_nonzero(winners == PLAYER1) > 50 and np.count_nonzero(winners == PLAYER2) > 50
+	assert np.array_equal(board, initialize_game_state())
+
+	#same seed, same games
+	assert np.array_equal(random_playouts(board, PLAYER1, 20, make_rng_state(7)),
+						  random_playouts(board, PLAYER1, 20, make_rng_state(7)))
+
+	#a batch plays the same games as single playouts one after the other
+	positions = [position for position in random_game_boards(seed=5, games=3) if not connected_four(position[0], position[1])]
+	boards = np.stack([board for board, _, _ in positions])
+	players = np.array([PLAYER2 if player == PLAYER1 else PLAYER1 for _, player, _ in positions], dtype=BoardPiece)
+	rng_state = make_rng_state(11)
+	expected = [random_playout(board, player, rng_state) for board, player in zip(boards, players)]
+	assert list(random_playouts_batch(boards, players, make_rng_state(11))) == expected
+
+	#recorded playouts are the same games, the cells replay them
+	moves = np.empty(42, dtype=np.int8)
+	for board, player in zip(boards, players):
+		winner = random_playout_record(board, player, make_rng_state(4), moves)
+		assert winner == random_playout(board, player, make_rng_state(4))
+		replay = board.copy()
+		for cell in moves[moves >= 0]:
+			row, col = divmod(int(cell), 7)
+			assert replay[row, col] == NO_PLAYER and (row == 0 or replay[row - 1, col] != NO_PLAYER)
+			replay[row, col] = player
+			player = PLAYER2 if player == PLAYER1 else PLAYER1
+		assert winner == NO_PLAYER or connected_four(replay, winner)
+
+	#full board is a draw, the last free spot is forced
+	draw_board = string_to_board(full_draw_board)
+	assert random_playout(draw_board, PLAYER1, make_rng_state(0)) == NO_PLAYER
+	for spot in range(7):
+		board = draw_board.copy()
+		player = board[5, spot]
+		board[5, spot] = NO_PLAYER
+		expected = player if connected_four(draw_board, player) else NO_PLAYER
+		assert random_playout(board, player, make_rng_state(0)) == expected
+
+def test_win_check_backends():
+	from agents import common
+	from importlib import import_module
+	from agents.common import WIN_CHECK_BACKENDS, win_check, set_win_check_backend, get_win_check_backend, \
+		calibrate_win_check, connected_four_bitmask, bitboard_mask, board_to_bitboard
+
+	previous = get_win_check_backend()
+	positions = random_game_boards(seed=3, games=5)
+	try:
+		for name in WIN_CHECK_BACKENDS:
+			assert set_win_check_backend(name) == name == get_win_check_backend()
+			for board, player, action in positions:
+				for piece in (PLAYER1, PLAYER2):
+					assert win_check(board, piece) == connected_four(board, piece)
+					assert win_check(board, piece, action) == connected_four(board, piece)
+
+		assert calibrate_win_check(['python', 'bitboard'], number=5) in ('python', 'bitboard')
+		#backends that can't be loaded are skipped
+		WIN_CHECK_BACKENDS['broken'] = lambda: import_module('no_such_win_check_module')
+		assert calibrate_win_check(['broken', 'python'], number=5) == 'python'
+		assert calibrate_win_check(['broken', 'python'], number=5, last_action_share=0) == 'python'
+		try:
+			calibrate_win_check(['broken'], number=5)
+			assert False
+		except RuntimeError:
+			pass
+		assert set_win_check_backend('auto') in WIN_CHECK_BACKENDS
+		try:
+			set_win_check_backend('fortran')
+			assert False
+		except ValueError:
+			pass
+	finally:
+		WIN_CHECK_BACKENDS.pop('broken', None)
+		set_win_check_backend(previous)
+
+	for board, _, _ in positions:
+		assert bitboard_mask(board, PLAYER1) == board_to_bitboard(board).masks[0]
+		assert connected_four_bitmask(board, PLAYER2) == connected_four(board, PLAYER2)
+
+	#compiled kernels are still available from agents.common
+	from agents.kernels import connected_four_iter
+	assert common.connected_four_iter is connected_four_iter
+
+def test_kernels_warm_up():
+	from agents import kernels
+
+	assert kernels.warm_up() == (kernels._aot is not None)
+	for name in kernels.AOT_SIGNATURES:
+		assert callable(kernels.compiled(name))
+
+	board = string_to_board(still_playing_board)
+	check = kernels.compiled('connected_four_iter')
+	for player in (PLAYER1, PLAYER2):
+		assert check(board, player) == connected_four(board, player)
+	assert np.array_equal(kernels.compiled('random_playouts')(board, PLAYER1, 5, kernels.make_rng_state(1)),
+						  kernels.random_playouts(board, PLAYER1, 5, kernels.make_rng_state(1)))